@@ -1,53 +1,12 @@
 import logging
 import json
 import os
+import socket
 import ssl
 import paho.mqtt.client as mqtt
-import asyncio
-from datetime import datetime, timezone
 from dotenv import load_dotenv
-from app.models.mqttModel import GPSDataModel
-from app.services.mqttService import process_gps_data
-from app.utils.decrypt import decrypt_message
+from app.services.ingestService import enqueue_gps_message
 from app.utils.time import get_ntp_time, get_accurate_time
-from app.config.sqlite import store_gps_data
-
-# Global variable to store socketio instance
-socketio_instance = None
-
-def set_socketio(sio):
-    """Set the Socket.IO instance to be used by MQTT module"""
-    global socketio_instance
-    socketio_instance = sio
-    
-# Helper function to run async emit in background
-def emit_socketio_event(event, data):
-    """Run socketio emit in an async context"""
-    if not socketio_instance:
-        logger.warning("Socket.IO not initialized, can't emit event")
-        return
-        
-    # Create a new event loop for this thread if needed
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    # Create a coroutine to emit the event
-    async def _emit():
-        try:
-            await socketio_instance.emit(event, data)
-        except Exception as e:
-            logger.error(f"Error emitting Socket.IO event: {str(e)}")
-    
-    # Run the coroutine in the event loop
-    if loop.is_running():
-        # If the loop is already running, we need to use create_task
-        asyncio.run_coroutine_threadsafe(_emit(), loop)
-    else:
-        # Otherwise, we can just run it directly
-        loop.run_until_complete(_emit())
 
 # Configure logging
 # logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -64,147 +23,57 @@ MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", "lokatrack-gps-1")
 MQTT_USERNAME = os.getenv("MQTT_USERNAME", "lokatrack-gps-1")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 MQTT_SECURE = os.getenv("MQTT_TLS", "true").lower()
+# MQTT protocol version: 5 or 3.1.1
+MQTT_PROTOCOL = os.getenv("MQTT_PROTOCOL", "5")
+# Shared subscription group, every worker in the group gets a share of the messages instead of all of them
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP", "")
+MQTT_QOS = int(os.getenv("MQTT_QOS", 0))
+
+# One or more comma separated topics trackers publish on
+MQTT_TOPICS = [topic.strip() for topic in MQTT_TOPIC.split(",") if topic.strip()]
 
 # MQTT client instance
 mqtt_client = None
 
 
+def get_subscription_topics():
+    """Topics to subscribe to, wrapped in $share/<group>/ when a shared group is configured"""
+    if MQTT_SHARED_GROUP:
+        return [f"$share/{MQTT_SHARED_GROUP}/{topic}" for topic in MQTT_TOPICS]
+    return list(MQTT_TOPICS)
+
+
+def get_client_id():
+    """Client id of this worker, unique per process when consuming through a shared group"""
+    if MQTT_SHARED_GROUP:
+        # The broker disconnects an older session with the same id, so every worker needs its own
+        return f"{MQTT_CLIENT_ID}-{socket.gethostname()}-{os.getpid()}"
+    return MQTT_CLIENT_ID
+
+
 # Callback when the client receives a CONNACK response from the server
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         logger.info("Connected to MQTT broker successfully")
-        # Subscribe to the topic upon successful connection
-        client.subscribe(MQTT_TOPIC)
-        logger.info(f"Subscribed to topic: {MQTT_TOPIC}")
+        # Subscribe to the topics upon successful connection
+        for topic in get_subscription_topics():
+            client.subscribe(topic, qos=MQTT_QOS)
+            logger.info(f"Subscribed to topic: {topic}")
     else:
         logger.error(f"Failed to connect to MQTT broker with code {rc}")
 
 
 # Callback when a message is received from the server
 def on_message(client, userdata, msg):
-    try:
-        # logger.debug(f"Received message on topic '{msg.topic}': {msg.payload}")
-        # receive_time = get_ntp_time()
-        receive_time = get_accurate_time()
-
-        # Decode the message payload
-        data = decrypt_message(msg.payload.decode("utf-8"))
-
-        # payload = msg.payload.decode("utf-8")
-        # logger.info(f"Raw payload: {msg.payload}")
-        # b'{\n  "id": "CC:DB:A7:9B:7A:00",\n  "lat": -6.2088,\n  "long": 106.8456\n}'
-
-        # Parse the JSON data
-        # data = json.loads(payload)
-        # logger.info(f"data: {payload}")
-        # {
-        #   "id": "CC:DB:A7:9B:7A:00",
-        #   "lat": -6.2088,
-        #   "long": 106.8456
-        #   "timestamp": "2025-05-14T04:44:49.351Z"
-        # }
-
-        latency_ms = None
-        send_time = None
-
-        # Jika ada timestamp di pesan, hitung latency
-        if "timestamp" in data:
-            try:
-                if data["timestamp"].endswith('Z'):
-                # Replace Z with +00:00 (UTC)
-                    send_time = datetime.fromisoformat(data["timestamp"].replace('Z', '+00:00'))
-                else:
-                    send_time = datetime.fromisoformat(data["timestamp"])
-
-                # Parse timestamp dari pesan
-                # send_time = datetime.fromisoformat(data["timestamp"])
-                logger.debug(
-                    "---------------------------------------------------------------------------"
-                )
-                logger.debug(f"Current Time\t: {receive_time} ")
-                logger.debug(f"Device time\t\t: {send_time} ")
-                # Hitung latency dalam milidetik
-                latency_ms = (receive_time - send_time).total_seconds() * 1000
-                logger.debug(
-                    f"MQTT Latency\t: {latency_ms:.2f}ms for message from {data.get('id', 'unknown')}"
-                )
-                logger.debug(
-                    "---------------------------------------------------------------------------"
-                )
-            except (ValueError, KeyError) as e:
-                logger.warning(f"Could not calculate latency: {e}")  
-
-        # send via web socket
-        # sio.emit("tracker:location_update", gps_data.dict(), room=gps_data.trackerId)
-
-        # Store the GPS data in SQLite
-        store_gps_data( 
-            tracker_id=data.get("id"),
-            latitude=data.get("lat"),
-            longitude=data.get("long"),
-            receive_time=receive_time,
-            send_time=send_time,
-            latency_ms=latency_ms,
-            iteration=data.get("iteration")
-        )
-        gps_data = GPSDataModel(**data)
-
-        # Send the GPS data to the socket io
-        websocket_data = {
-            "trackerId": gps_data.id,
-            "location": {
-                "latitude": gps_data.lat,
-                "longitude": gps_data.long,
-            },
-            "timestamp": gps_data.timestamp,
-        }
-        # Use the global socketio instance via our helper function
-        emit_socketio_event("tracker:location_update", websocket_data)
-
-        # Process the GPS data (update Firestore)
-        process_gps_data(gps_data)
-        # For demonstration, we will just log the data
-
-    # except Exception as e:
-    #     logger.error(f"Error processing MQTT message: {str(e)}")
-    except Exception as e:
-        # Get exception type name
-        error_type = type(e).__name__
-        
-        # Handle different types of errors differently
-        if "ValidationError" in error_type:
-            # For Pydantic validation errors, show exactly which fields failed
-            error_details = str(e).split("\n")[1:3]  # Take just the key parts
-            logger.error(f"MQTT data validation failed: {' | '.join(error_details)}")
-            
-            # Log the received data for debugging (optional)
-            try:
-                logger.debug(f"Invalid data received from tracker: {data.get('id', 'unknown')}")
-            except:
-                pass
-                
-        elif "KeyError" in error_type:
-            # For missing keys
-            logger.error(f"Missing required field in MQTT message: {str(e)}")
-            
-        elif "JSONDecodeError" in error_type:
-            # For JSON parsing errors
-            logger.error(f"Invalid JSON format in MQTT message")
-            
-        elif "AttributeError" in error_type:
-            # For attribute errors (typically when trying to access attributes of None)
-            logger.error(f"MQTT processing error: Unexpected data structure")
-            
-        else:
-            # For other errors, provide a cleaner message
-            logger.error(f"MQTT processing error ({error_type}): {str(e)[:100]}")
-        
-        # For debugging, you can log the full error to debug level
-        logger.debug(f"Full error details: {str(e)}")
-    
+    """Timestamp the payload and hand it to the ingest pipeline, nothing else runs on the paho thread"""
+    # Hex JSON and raw binary payloads are told apart per message by the decode stage
+    # receive_time = get_ntp_time()
+    receive_time = get_accurate_time()
+    enqueue_gps_message(msg.payload, receive_time)
+
 
 # Callback when client disconnects
-def on_disconnect(client, userdata, rc):
+def on_disconnect(client, userdata, flags, rc, properties=None):
     if rc != 0:
         logger.warning(f"Unexpected disconnection from MQTT broker with code {rc}")
     else:
@@ -215,8 +84,9 @@ def clear_retained_messages():
     """Clear retained messages on the topic"""
     try:
         client = get_mqtt_client()
-        client.publish(MQTT_TOPIC, payload="", qos=0, retain=True)
-        logger.info(f"Cleared retained messages on topic: {MQTT_TOPIC}")
+        for topic in MQTT_TOPICS:
+            client.publish(topic, payload="", qos=0, retain=True)
+            logger.info(f"Cleared retained messages on topic: {topic}")
         return True
     except Exception as e:
         logger.error(f"Error clearing retained messages: {str(e)}")
@@ -230,8 +100,13 @@ def setup_mqtt_client():
     # # Create new MQTT client instance
     # mqtt_client = mqtt.Client(client_id=MQTT_CLIENT_ID)
 
-    # Create new MQTT client instance with protocol v311
-    mqtt_client = mqtt.Client(client_id=MQTT_CLIENT_ID, protocol=mqtt.MQTTv311)
+    # Create new MQTT client instance, v5 is needed for shared subscriptions
+    protocol = mqtt.MQTTv5 if MQTT_PROTOCOL == "5" else mqtt.MQTTv311
+    clientId = get_client_id()
+    mqtt_client = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2, client_id=clientId, protocol=protocol
+    )
+    logger.info(f"MQTT client id {clientId} (protocol {MQTT_PROTOCOL})")
 
     # Enable automatic reconnection with backoff
     mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
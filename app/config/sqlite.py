@@ -1,57 +1,198 @@
+import asyncio
 import sqlite3
 import os
+import base64
+import json
 import logging
-from datetime import datetime, timezone
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from dotenv import load_dotenv
+from app.utils.time import to_epoch_us, epoch_us_to_iso
 
 logger = logging.getLogger(__name__)
 
+# Load environment variables
+load_dotenv()
+
 # Create database directory if it doesn't exist
 DB_DIR = Path("data")
 DB_DIR.mkdir(exist_ok=True)
 
 DB_PATH = DB_DIR / "mqtt_data.db"
 
+# Group commit: flush buffered rows every N rows or M milliseconds, whichever comes first
+SQLITE_BATCH_ROWS = int(os.getenv("SQLITE_BATCH_ROWS", 500))
+SQLITE_FLUSH_MS = int(os.getenv("SQLITE_FLUSH_MS", 200))
+SQLITE_WRITE_QUEUE_SIZE = int(os.getenv("SQLITE_WRITE_QUEUE_SIZE", 1000))
+# NORMAL is durable with WAL except for the last commits on power loss
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", 4))
+# A read running longer than this is interrupted, so one huge query can't hold a pool connection
+SQLITE_READ_TIMEOUT_MS = int(os.getenv("SQLITE_READ_TIMEOUT_MS", 10000))
+# SQLite VM instructions between two checks of the read deadline
+SQLITE_PROGRESS_STEPS = 10000
+# Raw rows live in one table per UTC day, dropped after the retention window
+SQLITE_RETENTION_DAYS = max(1, int(os.getenv("SQLITE_RETENTION_DAYS", 30)))
+# 1-minute rollups of the raw rows are kept much longer
+SQLITE_ROLLUP_RETENTION_DAYS = int(os.getenv("SQLITE_ROLLUP_RETENTION_DAYS", 365))
+SQLITE_MAINTENANCE_INTERVAL = int(os.getenv("SQLITE_MAINTENANCE_INTERVAL", 60))
+# Long-running maintenance (retention, migrations) works in transactions of this many rows
+# so the writer is never locked out for long
+SQLITE_CHUNK_ROWS = 5000
+
+# GPS times are stored as integer epoch microseconds (UTC)
+MINUTE_US = 60 * 1_000_000
+HOUR_US = 60 * MINUTE_US
+DAY_US = 24 * HOUR_US
+# A minute is rolled up once no more rows can be queued for it
+SQLITE_ROLLUP_DELAY_US = 2 * MINUTE_US
+
+GPS_PARTITION_PREFIX = "mqtt_gps_data_"
+# The single table used before partitioning, read like a partition until it expires
+LEGACY_GPS_TABLE = "mqtt_gps_data_legacy"
+ROLLUP_TABLE = "mqtt_gps_rollup_1m"
+GPS_COLUMNS = ("id", "tracker_id", "latitude", "longitude", "receive_time", "send_time", "latency_ms", "created_at", "iteration")
+GPS_TIME_COLUMNS = ("receive_time", "send_time", "created_at")
+
+GPS_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tracker_id TEXT NOT NULL,
+    latitude REAL NULL,
+    longitude REAL NULL,
+    receive_time INTEGER NOT NULL,
+    send_time INTEGER,
+    latency_ms REAL,
+    created_at INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)),
+    iteration INTEGER DEFAULT 0
+)
+'''
+
+GPS_INDEX_SQL = (
+    # Queries by tracker_id, in receive time order (the rowid is the implicit last column, which
+    # keeps (receive_time, id) keyset pages on the index)
+    "CREATE INDEX IF NOT EXISTS idx_{table}_tracker_receive_time ON {table} (tracker_id, receive_time)",
+    # Time-based queries
+    "CREATE INDEX IF NOT EXISTS idx_{table}_receive_time ON {table} (receive_time)",
+)
+
+INSERT_GPS_DATA_SQL = '''
+INSERT INTO {table} 
+(id, tracker_id, latitude, longitude, receive_time, send_time, latency_ms, iteration, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Newest position of the minute comes from the row with the latest device time
+ROLLUP_GPS_DATA_SQL = '''
+INSERT OR REPLACE INTO mqtt_gps_rollup_1m
+(tracker_id, minute, messages, latency_count, latency_sum, latency_min, latency_max,
+ first_send_time, last_send_time, latitude, longitude)
+SELECT tracker_id, minute, COUNT(*), COUNT(latency_ms), TOTAL(latency_ms), MIN(latency_ms), MAX(latency_ms),
+    MIN(send_time), MAX(send_time),
+    MAX(CASE WHEN rn = 1 THEN latitude END), MAX(CASE WHEN rn = 1 THEN longitude END)
+FROM (
+    SELECT *, ROW_NUMBER() OVER (
+        PARTITION BY tracker_id, minute ORDER BY latitude IS NULL, send_time DESC
+    ) AS rn
+    FROM (
+        SELECT tracker_id, latitude, longitude, send_time, latency_ms,
+            receive_time / 60000000 * 60000000 AS minute
+        FROM {source}
+        WHERE receive_time >= :start AND receive_time < :end
+    )
+)
+GROUP BY tracker_id, minute
+'''
+
 def get_db_connection():
     """Get a connection to the SQLite database"""
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row  # This enables column access by name
     return conn
 
+def _configure_connection(conn):
+    """Apply the per-connection pragmas used by the writer and the read pool"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
 def init_db():
     """Initialize the database with required tables"""
+    conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # Create table for MQTT GPS data
+
+        # A new file can give the pages of dropped partitions back to the filesystem,
+        # an existing one keeps its mode and reuses them for new partitions
+        if cursor.execute("PRAGMA page_count").fetchone()[0] == 0:
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+        # WAL lets the pooled readers run while the writer is committing
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+        # Raw MQTT GPS data goes to day partitions, the old single table is kept as the oldest one
+        if cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mqtt_gps_data'"
+        ).fetchone():
+            cursor.execute(f"ALTER TABLE mqtt_gps_data RENAME TO {LEGACY_GPS_TABLE}")
+            logger.info(f"Kept existing GPS data as partition {LEGACY_GPS_TABLE}")
+
+        # Per tracker per minute summary of the raw rows, kept longer than the raw rows
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS mqtt_gps_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS mqtt_gps_rollup_1m (
             tracker_id TEXT NOT NULL,
-            latitude REAL NULL,
-            longitude REAL NULL,
-            receive_time DATETIME NOT NULL,
-            send_time DATETIME,
-            latency_ms REAL,
-            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            iteration INTEGER DEFAULT 0
-        )
+            minute INTEGER NOT NULL,
+            messages INTEGER NOT NULL,
+            latency_count INTEGER NOT NULL,
+            latency_sum REAL NOT NULL,
+            latency_min REAL,
+            latency_max REAL,
+            first_send_time INTEGER,
+            last_send_time INTEGER,
+            latitude REAL,
+            longitude REAL,
+            PRIMARY KEY (tracker_id, minute)
+        ) WITHOUT ROWID
         ''')
-        
-        # Create index for faster queries by tracker_id
+
         cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_tracker_id
-        ON mqtt_gps_data (tracker_id)
+        CREATE INDEX IF NOT EXISTS idx_rollup_minute
+        ON mqtt_gps_rollup_1m (minute)
         ''')
-        
-        # Create index for time-based queries
+
+        # Progress of the background maintenance, e.g. the last minute rolled up
         cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_receive_time
-        ON mqtt_gps_data (receive_time)
+        CREATE TABLE IF NOT EXISTS mqtt_gps_maintenance (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
         ''')
-        
         conn.commit()
+
+        # Indexes of the table used before partitioning, the legacy table gets the partition indexes below.
+        # Dropped before the migration so it doesn't have to update them.
+        conn.execute("DROP INDEX IF EXISTS idx_tracker_id")
+        conn.execute("DROP INDEX IF EXISTS idx_receive_time")
+        conn.commit()
+
+        _migrate_text_times(conn)
+
+        # Partitions created before an index was added get it now
+        for _, table in _list_partitions(conn):
+            for sql in GPS_INDEX_SQL:
+                conn.execute(sql.format(table=table))
+            # Covered by the composite index
+            conn.execute(f"DROP INDEX IF EXISTS idx_{table}_tracker_id")
+        conn.commit()
+
         logger.info("SQLite database initialized successfully")
         return True
     except Exception as e:
@@ -61,95 +202,739 @@ def init_db():
         if conn:
             conn.close()
 
-def store_gps_data(tracker_id, latitude, longitude, receive_time, iteration, send_time=None, latency_ms=None):
-    """Store GPS data in SQLite database"""
+@lru_cache(maxsize=64)
+def _partition_for_day(day):
+    return GPS_PARTITION_PREFIX + (datetime(1970, 1, 1) + timedelta(days=day)).strftime("%Y%m%d")
+
+def _partition_name(receive_time):
+    """Day partition a row belongs to, by its receive time in epoch microseconds"""
+    return _partition_for_day(receive_time // DAY_US)
+
+def _list_partitions(conn):
+    """GPS tables as (day number since the epoch, table), newest first, the legacy table last with day None"""
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+        (GPS_PARTITION_PREFIX + "[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]",),
+    ).fetchall()
+    partitions = sorted(
+        (
+            ((datetime.strptime(row[0][len(GPS_PARTITION_PREFIX):], "%Y%m%d") - datetime(1970, 1, 1)).days, row[0])
+            for row in rows
+        ),
+        reverse=True,
+    )
+    if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (LEGACY_GPS_TABLE,)
+    ).fetchone():
+        partitions.append((None, LEGACY_GPS_TABLE))
+    return partitions
+
+def _partitions_between(conn, start, end):
+    """GPS tables that can hold rows received in [start, end) epoch microseconds, newest first"""
+    first = start // DAY_US
+    last = end // DAY_US
+    return [table for day, table in _list_partitions(conn) if day is None or first <= day <= last]
+
+def _gps_source(tables):
+    """FROM clause reading several GPS tables as one, filters are pushed down into each of them"""
+    columns = ", ".join(GPS_COLUMNS)
+    if not tables:
+        return "(SELECT " + ", ".join(f"NULL AS {column}" for column in GPS_COLUMNS) + " LIMIT 0)"
+    return "(" + " UNION ALL ".join(f"SELECT {columns} FROM {table}" for table in tables) + ")"
+
+def _get_maintenance_value(conn, name):
+    row = conn.execute("SELECT value FROM mqtt_gps_maintenance WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def _set_maintenance_value(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO mqtt_gps_maintenance (name, value) VALUES (?, ?)", (name, str(value)))
+
+def _max_gps_id(conn):
+    """Highest id given to a GPS row so far, in any partition, including dropped ones"""
+    last_id = int(_get_maintenance_value(conn, "gps_last_id") or 0)
+    # sqlite_sequence only exists once a partition was created
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+        seq = conn.execute(
+            "SELECT MAX(seq) FROM sqlite_sequence WHERE name GLOB ?", (GPS_PARTITION_PREFIX + "*",)
+        ).fetchone()[0]
+        last_id = max(last_id, seq or 0)
+    return last_id
+
+def _text_to_epoch_us(value):
+    """SQL function for the migration, values that don't parse are left as they are"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # logger.debug(f"All Time : {receive_time} - {send_time} = {latency_ms} ms")
-        # logger.debug(f"Data type for time : {type(receive_time)} - {type(send_time)}")
-        # Convert datetime objects to ISO format strings
-        # if isinstance(receive_time, datetime):
-        #     receive_time = receive_time.isoformat()
-        
-        # if isinstance(send_time, datetime):
-        #     send_time = send_time.isoformat()
-        
-        # current_time = datetime.now().isoformat()
-        
-        cursor.execute('''
-        INSERT INTO mqtt_gps_data 
-        (tracker_id, latitude, longitude, receive_time, send_time, latency_ms, iteration)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            tracker_id, 
-            latitude, 
-            longitude, 
-            receive_time, 
-            send_time,
-            latency_ms,
-            iteration
-            # current_time
-        ))
-        
-        conn.commit()
+        return to_epoch_us(value)
+    except (TypeError, ValueError, AttributeError):
+        return value
+
+def _migrate_text_times(conn):
+    """Convert ISO text times stored before epoch microseconds to integers, chunked and once per table"""
+    conn.create_function("to_epoch_us", 1, _text_to_epoch_us, deterministic=True)
+
+    for _, table in _list_partitions(conn):
+        declared = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table})")}
+        marker = f"epoch_us:{table}"
+        if declared.get("receive_time") == "INTEGER" or _get_maintenance_value(conn, marker):
+            continue
+
+        last_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+        logger.info(f"Converting times of {table} to epoch microseconds ({last_id} rows)")
+        for low in range(0, last_id, SQLITE_CHUNK_ROWS):
+            with conn:
+                conn.execute(f'''
+                UPDATE {table}
+                SET receive_time = to_epoch_us(receive_time),
+                    send_time = to_epoch_us(send_time),
+                    created_at = to_epoch_us(created_at)
+                WHERE id > ? AND id <= ?
+                    AND (typeof(receive_time) = 'text' OR typeof(send_time) = 'text' OR typeof(created_at) = 'text')
+                ''', (low, low + SQLITE_CHUNK_ROWS))
+        with conn:
+            _set_maintenance_value(conn, marker, "done")
+
+    declared = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(mqtt_gps_rollup_1m)")}
+    if declared.get("minute") != "INTEGER" and not _get_maintenance_value(conn, "epoch_us:mqtt_gps_rollup_1m"):
+        with conn:
+            conn.execute('''
+            UPDATE mqtt_gps_rollup_1m
+            SET minute = to_epoch_us(minute),
+                first_send_time = to_epoch_us(first_send_time),
+                last_send_time = to_epoch_us(last_send_time)
+            WHERE typeof(minute) = 'text'
+            ''')
+            watermark = _get_maintenance_value(conn, "rollup_watermark")
+            if watermark and not watermark.isdigit():
+                _set_maintenance_value(conn, "rollup_watermark", to_epoch_us(watermark))
+            _set_maintenance_value(conn, "epoch_us:mqtt_gps_rollup_1m", "done")
+
+# Rows waiting for the writer thread, each item is a list of row tuples
+_write_queue = queue.Queue(maxsize=SQLITE_WRITE_QUEUE_SIZE)
+_writer_thread = None
+_writer_lock = threading.Lock()
+_WRITER_STOP = object()
+# Partitions the writer already created
+_known_partitions = set()
+
+def _create_partitions(conn, tables):
+    """Create the day tables not seen yet, returns them so they are only remembered once committed"""
+    created = [table for table in tables if table not in _known_partitions]
+    for table in created:
+        conn.execute(GPS_TABLE_SQL.format(table=table))
+        for sql in GPS_INDEX_SQL:
+            conn.execute(sql.format(table=table))
+    return created
+
+def _insert_partitions(conn, partitions, one_by_one=False):
+    """
+    Insert rows into their partitions in one transaction, returns how many were stored and the new partitions.
+    Every partition has its own AUTOINCREMENT sequence, so ids are handed out here to keep them
+    unique across partitions, late rows for an older day included.
+    """
+    stored = 0
+    with conn:
+        # Taking the write lock first keeps the id range safe with several writer processes
+        conn.execute("BEGIN IMMEDIATE")
+        created = _create_partitions(conn, partitions)
+        last_id = _max_gps_id(conn)
+        for table, partition_rows in partitions.items():
+            partition_rows = [(last_id + i + 1, *row) for i, row in enumerate(partition_rows)]
+            last_id += len(partition_rows)
+            sql = INSERT_GPS_DATA_SQL.format(table=table)
+            if not one_by_one:
+                conn.executemany(sql, partition_rows)
+                stored += len(partition_rows)
+                continue
+            for row in partition_rows:
+                try:
+                    conn.execute(sql, row)
+                    stored += 1
+                except (sqlite3.Error, OverflowError) as e:
+                    logger.error(f"Error storing GPS data in SQLite: {str(e)}")
+    return stored, created
+
+def _sql_value(value):
+    """Invalid messages are archived with their raw values, store what SQLite can't bind as JSON text"""
+    if value is None or isinstance(value, (float, str, bytes)):
+        return value
+    if isinstance(value, int) and -2**63 <= value < 2**63:
+        return value
+    return json.dumps(value, default=str)
+
+def _flush_rows(conn, rows):
+    """Insert buffered rows in a single transaction"""
+    created_at = time.time_ns() // 1000
+    partitions = {}
+    for tracker_id, latitude, longitude, receive_time, send_time, latency_ms, iteration in rows:
+        receive_time = to_epoch_us(receive_time)
+        partitions.setdefault(_partition_name(receive_time), []).append(
+            (
+                _sql_value(tracker_id), _sql_value(latitude), _sql_value(longitude), receive_time,
+                to_epoch_us(send_time), latency_ms, _sql_value(iteration), created_at,
+            )
+        )
+    try:
+        _, created = _insert_partitions(conn, partitions)
+        _known_partitions.update(created)
         return True
+    except sqlite3.Error:
+        # One bad row must not take the whole group down, retry them one by one
+        stored, created = _insert_partitions(conn, partitions, one_by_one=True)
+        _known_partitions.update(created)
+        return stored == len(rows)
     except Exception as e:
-        logger.error(f"Error storing GPS data in SQLite: {str(e)}")
+        logger.error(f"Error storing {len(rows)} GPS rows in SQLite: {str(e)}")
         return False
+
+def _writer_loop():
+    """Own the single write connection and group-commit everything that is queued"""
+    conn = _configure_connection(sqlite3.connect(str(DB_PATH)))
+    pending = []
+    deadline = None
+    try:
+        while True:
+            # Wait for new rows, but never past the flush deadline of what is buffered
+            timeout = max(0, deadline - time.monotonic()) if pending else 0.5
+            try:
+                item = _write_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _WRITER_STOP:
+                break
+            if item:
+                if not pending:
+                    deadline = time.monotonic() + SQLITE_FLUSH_MS / 1000
+                pending.extend(item)
+
+            if pending and (len(pending) >= SQLITE_BATCH_ROWS or time.monotonic() >= deadline):
+                _safe_flush_rows(conn, pending)
+                pending = []
+
+        if pending:
+            _safe_flush_rows(conn, pending)
     finally:
-        if conn:
-            conn.close()
+        conn.close()
 
-def get_recent_gps_data(trackerId=None, limit=100):
-    """Get recent GPS data from SQLite database"""
+def _safe_flush_rows(conn, rows):
+    """Flush without ever letting an error end the writer thread, the rows are lost instead"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if trackerId:
-            cursor.execute('''
-            SELECT * FROM mqtt_gps_data 
-            WHERE tracker_id = ? 
-            ORDER BY id DESC LIMIT ?
-            ''', (trackerId, limit))
-        else:
-            cursor.execute('''
-            SELECT * FROM mqtt_gps_data 
-            ORDER BY id DESC LIMIT ?
-            ''', (limit,))
-        
-        rows = cursor.fetchall()
-        # return [dict(row) for row in rows]
-        # Convert datetime strings back to datetime objects
-        result = []
-        for row in rows:
-            row_dict = dict(row)
-            # SQLite returns datetime as string, convert back to datetime objects
-            for field in ['receive_time', 'send_time', 'created_at']:
-                if row_dict.get(field):
-                    try:
-                        # Handle both formats: with and without 'Z' suffix
-                        time_str = row_dict[field]
-                        if time_str.endswith('Z'):
-                            row_dict[field] = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-                        elif '+' in time_str or time_str.endswith('UTC'):
-                            row_dict[field] = datetime.fromisoformat(time_str)
-                        else:
-                            # Assume UTC if no timezone info
-                            row_dict[field] = datetime.fromisoformat(time_str).replace(tzinfo=timezone.utc)
-                    except ValueError:
-                        # Keep as string if conversion fails
-                        pass
-            result.append(row_dict)
-        
-        return result
+        _flush_rows(conn, rows)
+    except Exception:
+        logger.exception(f"Error storing {len(rows)} GPS rows in SQLite")
+
+def start_gps_writer():
+    """Start the background SQLite writer if it is not running yet"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="sqlite-writer", daemon=True)
+            _writer_thread.start()
+
+def stop_gps_writer(timeout=10):
+    """Flush buffered rows and stop the background SQLite writer"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            return
+        _write_queue.put(_WRITER_STOP)
+        _writer_thread.join(timeout=timeout)
+        _writer_thread = None
+
+def store_gps_batch(rows):
+    """Queue GPS rows for the writer, rows are (tracker_id, latitude, longitude, receive_time, send_time, latency_ms, iteration)"""
+    if not rows:
+        return True
+    try:
+        start_gps_writer()
+        # Blocks when the writer is behind, pushing back on the ingest worker
+        _write_queue.put(list(rows))
+        return True
     except Exception as e:
-        logger.error(f"Error retrieving GPS data from SQLite: {str(e)}")
-        return []
+        logger.error(f"Error queueing GPS data for SQLite: {str(e)}")
+        return False
+
+def store_gps_data(tracker_id, latitude, longitude, receive_time, iteration, send_time=None, latency_ms=None):
+    """Store GPS data in SQLite database"""
+    return store_gps_batch([(
+        tracker_id, 
+        latitude, 
+        longitude, 
+        receive_time, 
+        send_time,
+        latency_ms,
+        iteration
+    )])
+
+_maintenance_thread = None
+_maintenance_stop = threading.Event()
+
+def _rollup_gps_data(conn, now):
+    """Roll up every finished minute since the last run into mqtt_gps_rollup_1m, one hour per transaction"""
+    until = (now - SQLITE_ROLLUP_DELAY_US) // MINUTE_US * MINUTE_US
+    watermark = _get_maintenance_value(conn, "rollup_watermark")
+    if watermark:
+        since = int(watermark)
+    else:
+        # First run: start at the oldest stored row
+        oldest = [
+            conn.execute(f"SELECT MIN(receive_time) FROM {table}").fetchone()[0]
+            for _, table in _list_partitions(conn)
+        ]
+        oldest = [value for value in oldest if value is not None]
+        since = min(oldest) // MINUTE_US * MINUTE_US if oldest else until
+        if since >= until:
+            with conn:
+                _set_maintenance_value(conn, "rollup_watermark", until)
+            return
+
+    while since < until and not _maintenance_stop.is_set():
+        step_end = min(since + HOUR_US, until)
+        source = _gps_source(_partitions_between(conn, since, step_end))
+        with conn:
+            conn.execute(ROLLUP_GPS_DATA_SQL.format(source=source), {"start": since, "end": step_end})
+            _set_maintenance_value(conn, "rollup_watermark", step_end)
+        since = step_end
+
+def _drop_partition(conn, table):
+    """Empty a partition in small transactions, then drop it, returns False if interrupted by shutdown"""
+    while True:
+        with conn:
+            deleted = conn.execute(
+                f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} LIMIT ?)",
+                (SQLITE_CHUNK_ROWS,),
+            ).rowcount
+        if deleted < SQLITE_CHUNK_ROWS:
+            break
+        # Give the writer a chance to take the lock between chunks
+        if _maintenance_stop.wait(0.01):
+            return False
+    with conn:
+        # Its sequence goes with it, remember the highest id so new rows never reuse it
+        _set_maintenance_value(conn, "gps_last_id", _max_gps_id(conn))
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    _known_partitions.discard(table)
+    logger.info(f"Dropped expired GPS partition {table}")
+    return True
+
+def _apply_retention(conn, now):
+    """Drop raw partitions past SQLITE_RETENTION_DAYS once rolled up, and rollups past their own retention"""
+    cutoff = now - SQLITE_RETENTION_DAYS * DAY_US
+    watermark = _get_maintenance_value(conn, "rollup_watermark")
+    watermark = int(watermark) if watermark else None
+    for day, table in _list_partitions(conn):
+        if day is None:
+            newest = conn.execute(f"SELECT MAX(receive_time) FROM {table}").fetchone()[0]
+            expired = newest is None or newest < cutoff
+            rolled_up = newest is None or (watermark is not None and newest < watermark)
+        else:
+            expired = day < cutoff // DAY_US
+            rolled_up = watermark is not None and (day + 1) * DAY_US <= watermark
+        if not expired:
+            continue
+        if not rolled_up:
+            logger.warning(f"GPS partition {table} expired but is not rolled up yet, keeping it")
+            continue
+        if not _drop_partition(conn, table):
+            return
+
+    with conn:
+        conn.execute("DELETE FROM mqtt_gps_rollup_1m WHERE minute < ?", (now - SQLITE_ROLLUP_RETENTION_DAYS * DAY_US,))
+
+    # Only a file created with incremental auto vacuum can shrink, a little at a time
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] and not _maintenance_stop.is_set():
+            # execute() would only free a single page, the script runs the pragma to completion
+            conn.executescript("PRAGMA incremental_vacuum(1000);")
+            _maintenance_stop.wait(0.01)
+
+def run_gps_maintenance(conn, now=None):
+    """Roll up finished minutes, then drop what is past retention"""
+    now = to_epoch_us(now or datetime.now(timezone.utc))
+    _rollup_gps_data(conn, now)
+    _apply_retention(conn, now)
+
+def _maintenance_loop():
+    """Own a separate write connection so rollups and retention never run on the writer thread"""
+    conn = _configure_connection(sqlite3.connect(str(DB_PATH)))
+    try:
+        while True:
+            try:
+                run_gps_maintenance(conn)
+            except Exception as e:
+                logger.error(f"Error during SQLite GPS maintenance: {str(e)}")
+            if _maintenance_stop.wait(SQLITE_MAINTENANCE_INTERVAL):
+                break
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+
+def start_gps_maintenance():
+    """Start the background rollup and retention job if it is not running yet"""
+    global _maintenance_thread
+    with _writer_lock:
+        if _maintenance_thread is None or not _maintenance_thread.is_alive():
+            _maintenance_stop.clear()
+            _maintenance_thread = threading.Thread(target=_maintenance_loop, name="sqlite-maintenance", daemon=True)
+            _maintenance_thread.start()
+
+def stop_gps_maintenance(timeout=10):
+    """Stop the background rollup and retention job, a partly dropped partition is finished next time"""
+    global _maintenance_thread
+    with _writer_lock:
+        if _maintenance_thread is None:
+            return
+        _maintenance_stop.set()
+        _maintenance_thread.join(timeout=timeout)
+        _maintenance_thread = None
+
+# Pool of read-only connections shared by request handlers
+_read_pool = queue.Queue(maxsize=SQLITE_READ_POOL_SIZE)
+_read_pool_lock = threading.Lock()
+_read_pool_created = 0
+# Reads run on these threads, one per pooled connection, never on the event loop
+_read_executor = ThreadPoolExecutor(max_workers=SQLITE_READ_POOL_SIZE, thread_name_prefix="sqlite-read")
+
+def _open_read_connection():
+    """Open a connection that can't write, even by accident"""
+    conn = sqlite3.connect(f"{DB_PATH.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+@contextmanager
+def get_read_connection(timeout_ms=SQLITE_READ_TIMEOUT_MS):
+    """
+    Borrow a pooled read connection, opening a new one while the pool is not full.
+    Raises TimeoutError when the reads made with it take longer than timeout_ms.
+    """
+    global _read_pool_created
+    conn = None
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        with _read_pool_lock:
+            if _read_pool_created < SQLITE_READ_POOL_SIZE:
+                conn = _open_read_connection()
+                _read_pool_created += 1
+        if conn is None:
+            conn = _read_pool.get()
+
+    # SQLite calls the handler while a statement runs, a true result interrupts it
+    deadline = time.monotonic() + timeout_ms / 1000
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+    try:
+        yield conn
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted":
+            raise TimeoutError(f"SQLite read took longer than {timeout_ms} ms") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+        _read_pool.put(conn)
+
+async def run_sqlite_read(func, *args, **kwargs):
+    """Run a blocking SQLite read on the read threads, so the event loop keeps serving other requests"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, partial(func, *args, **kwargs))
+
+def get_recent_gps_columns(trackerId=None, limit=100):
+    """Get recent GPS rows as columns (newest first), times stay epoch microseconds"""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        # Plain tuples, the rows are only transposed into columns
+        cursor.row_factory = None
+        columns = ", ".join(GPS_COLUMNS)
+
+        # Newest partition first, older ones only until the limit is reached
+        rows = []
+        for _, table in _list_partitions(conn):
+            if trackerId:
+                cursor.execute(f'''
+                SELECT {columns} FROM {table} 
+                WHERE tracker_id = ? 
+                ORDER BY receive_time DESC, id DESC LIMIT ?
+                ''', (trackerId, limit - len(rows)))
+            else:
+                cursor.execute(f'''
+                SELECT {columns} FROM {table} 
+                ORDER BY receive_time DESC, id DESC LIMIT ?
+                ''', (limit - len(rows),))
+            rows.extend(cursor.fetchall())
+            if len(rows) >= limit:
+                break
+
+    values = list(zip(*rows)) if rows else [()] * len(GPS_COLUMNS)
+    return {column: list(column_values) for column, column_values in zip(GPS_COLUMNS, values)}
+
+def _partition_key(day):
+    """Position of a partition in receive time order, legacy rows were all received before the first partition"""
+    return -1 if day is None else day
+
+def encode_gps_cursor(order, partition, receive_time, row_id):
+    """Opaque cursor pointing just after a row"""
+    raw = json.dumps([order, partition, receive_time, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_gps_cursor(cursor, order):
+    """Read a cursor made by encode_gps_cursor, raises ValueError if it is invalid or for another order"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_order, partition, receive_time, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_order != order or not all(isinstance(value, int) for value in (partition, receive_time, row_id)):
+        raise ValueError("Invalid cursor")
+    return partition, receive_time, row_id
+
+def query_gps_columns(trackerId=None, start=None, end=None, after=None, limit=100, order="asc"):
+    """
+    Page through raw GPS rows in receive time order with a keyset cursor.
+    Args:
+        trackerId (str, optional): Only rows of this tracker.
+        start (datetime, optional): Receive time from (inclusive).
+        end (datetime, optional): Receive time until (exclusive).
+        after (tuple, optional): Where the previous page ended, decode_gps_cursor of its nextCursor.
+        limit (int): Rows per page.
+        order (str): "asc" (oldest first) or "desc" (newest first).
+    Returns:
+        tuple: (columns like get_recent_gps_columns, cursor of the next page or None)
+    """
+    descending = order == "desc"
+    params = {
+        "start": to_epoch_us(start) if start else 0,
+        "end": to_epoch_us(end) if end else 2**63 - 1,
+        "trackerId": trackerId,
+    }
+    where = "receive_time >= :start AND receive_time < :end"
+    if trackerId:
+        where += " AND tracker_id = :trackerId"
+    if descending:
+        resume = "receive_time <= :afterTime AND (receive_time < :afterTime OR id < :afterId)"
+        sort = "receive_time DESC, id DESC"
+    else:
+        resume = "receive_time >= :afterTime AND (receive_time > :afterTime OR id > :afterId)"
+        sort = "receive_time, id"
+    columns = ", ".join(GPS_COLUMNS)
+
+    rows = []
+    # Partition of every row, the cursor has to say where to resume
+    row_partitions = []
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = None
+        partitions = [
+            (_partition_key(day), table)
+            for day, table in _list_partitions(conn)
+            if day is None or params["start"] // DAY_US <= day <= params["end"] // DAY_US
+        ]
+        partitions.sort(reverse=descending)
+
+        for partition, table in partitions:
+            conditions = where
+            if after:
+                # Skip partitions the previous pages already went through
+                if partition > after[0] if descending else partition < after[0]:
+                    continue
+                if partition == after[0]:
+                    conditions += " AND " + resume
+                    params["afterTime"], params["afterId"] = after[1], after[2]
+            # One extra row tells whether there is a next page
+            params["limit"] = limit + 1 - len(rows)
+            db_cursor.execute(
+                f"SELECT {columns} FROM {table} WHERE {conditions} ORDER BY {sort} LIMIT :limit", params
+            )
+            fetched = db_cursor.fetchall()
+            rows.extend(fetched)
+            row_partitions.extend([partition] * len(fetched))
+            if len(rows) > limit:
+                break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_gps_cursor(
+            order, row_partitions[limit - 1], last[GPS_COLUMNS.index("receive_time")], last[GPS_COLUMNS.index("id")]
+        )
+
+    values = list(zip(*rows)) if rows else [()] * len(GPS_COLUMNS)
+    return {column: list(column_values) for column, column_values in zip(GPS_COLUMNS, values)}, next_cursor
+
+def gps_columns_to_json(columns):
+    """Format the time columns as ISO 8601 strings, a whole column at a time"""
+    return {
+        column: epoch_us_to_iso(values) if column in GPS_TIME_COLUMNS else values
+        for column, values in columns.items()
+    }
+
+# Latency percentiles reported by get_latency_stats
+LATENCY_PERCENTILES = (50, 95, 99)
+
+def _percentile_columns(percentiles):
+    """Nearest-rank percentile of latency_ms over rows ranked by rn within cnt"""
+    return ", ".join(
+        f"MIN(CASE WHEN rn >= {p / 100} * cnt THEN latency_ms END) AS p{p}" for p in percentiles
+    )
+
+def get_latency_stats(start, end, trackerId=None, gapSeconds=60, limit=100):
+    """
+    Compute latency percentiles, message rate and reporting gaps inside SQLite.
+    Args:
+        start (datetime): Window start (receive time, inclusive).
+        end (datetime): Window end (receive time, exclusive).
+        trackerId (str, optional): Only analyse this tracker.
+        gapSeconds (float): Device time between two fixes above which it counts as a gap.
+        limit (int): Maximum number of trackers returned, worst p95 first.
+    Returns:
+        dict: Fleet-wide stats, per-tracker stats and a per-minute timeline.
+    """
+    windowMinutes = max((end - start).total_seconds() / 60, 1 / 60)
+    params = {"start": to_epoch_us(start), "end": to_epoch_us(end), "gap": gapSeconds, "limit": limit}
+    where = "receive_time >= :start AND receive_time < :end"
+    if trackerId:
+        where += " AND tracker_id = :trackerId"
+        params["trackerId"] = trackerId
+    percentiles = _percentile_columns(LATENCY_PERCENTILES)
+
+    with get_read_connection() as conn:
+        source = _gps_source(_partitions_between(conn, params["start"], params["end"]))
+
+        # Per tracker: latency percentiles over the window, gaps between consecutive device times
+        trackers = conn.execute(f'''
+        WITH windowed AS (
+            SELECT tracker_id, latency_ms, send_time, receive_time
+            FROM {source} WHERE {where} AND tracker_id IS NOT NULL
+        ),
+        ranked AS (
+            SELECT tracker_id, latency_ms,
+                ROW_NUMBER() OVER (PARTITION BY tracker_id ORDER BY latency_ms) AS rn,
+                COUNT(*) OVER (PARTITION BY tracker_id) AS cnt
+            FROM windowed WHERE latency_ms IS NOT NULL
+        ),
+        latency AS (
+            SELECT tracker_id, {percentiles}, AVG(latency_ms) AS avg_ms, MAX(latency_ms) AS max_ms
+            FROM ranked GROUP BY tracker_id
+        ),
+        intervals AS (
+            SELECT tracker_id,
+                (send_time - LAG(send_time) OVER (
+                    PARTITION BY tracker_id ORDER BY send_time
+                )) / 1000000.0 AS gap_s
+            FROM windowed WHERE send_time IS NOT NULL
+        ),
+        gaps AS (
+            SELECT tracker_id,
+                AVG(gap_s) AS avg_interval_s,
+                MAX(gap_s) AS max_gap_s,
+                SUM(gap_s > :gap) AS gap_count,
+                TOTAL(CASE WHEN gap_s > :gap THEN gap_s END) AS gap_total_s
+            FROM intervals WHERE gap_s IS NOT NULL GROUP BY tracker_id
+        ),
+        counts AS (
+            SELECT tracker_id, COUNT(*) AS messages,
+                MIN(receive_time) AS first_seen, MAX(receive_time) AS last_seen
+            FROM windowed GROUP BY tracker_id
+        )
+        SELECT * FROM counts
+        LEFT JOIN latency USING (tracker_id)
+        LEFT JOIN gaps USING (tracker_id)
+        ORDER BY p95 IS NULL, p95 DESC
+        LIMIT :limit
+        ''', params).fetchall()
+
+        fleet = conn.execute(f'''
+        WITH ranked AS (
+            SELECT latency_ms,
+                ROW_NUMBER() OVER (ORDER BY latency_ms) AS rn,
+                COUNT(*) OVER () AS cnt
+            FROM {source} WHERE {where} AND latency_ms IS NOT NULL
+        )
+        SELECT {percentiles}, AVG(latency_ms) AS avg_ms, MAX(latency_ms) AS max_ms FROM ranked
+        ''', params).fetchone()
+
+        totals = conn.execute(f'''
+        SELECT COUNT(*) AS messages, COUNT(DISTINCT tracker_id) AS trackers
+        FROM {source} WHERE {where}
+        ''', params).fetchone()
+
+        timeline = conn.execute(f'''
+        SELECT receive_time / 60000000 * 60000000 AS minute,
+            COUNT(*) AS messages, COUNT(DISTINCT tracker_id) AS trackers,
+            AVG(latency_ms) AS avgLatencyMs, MAX(latency_ms) AS maxLatencyMs
+        FROM {source} WHERE {where}
+        GROUP BY minute ORDER BY minute
+        ''', params).fetchall()
+
+    # Times become ISO strings here, a column at a time
+    first_seen = epoch_us_to_iso([row["first_seen"] for row in trackers])
+    last_seen = epoch_us_to_iso([row["last_seen"] for row in trackers])
+    minutes = epoch_us_to_iso([row["minute"] for row in timeline])
+
+    def latency(row):
+        return {
+            **{f"p{p}": row[f"p{p}"] for p in LATENCY_PERCENTILES},
+            "avg": row["avg_ms"],
+            "max": row["max_ms"],
+        }
+
+    return {
+        "window": {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "gapSeconds": gapSeconds,
+        },
+        "fleet": {
+            "messages": totals["messages"],
+            "trackers": totals["trackers"],
+            "messagesPerMinute": totals["messages"] / windowMinutes,
+            "latencyMs": latency(fleet),
+        },
+        "trackers": [
+            {
+                "trackerId": row["tracker_id"],
+                "messages": row["messages"],
+                "messagesPerMinute": row["messages"] / windowMinutes,
+                "firstSeen": first_seen[index],
+                "lastSeen": last_seen[index],
+                "latencyMs": latency(row),
+                "gaps": {
+                    "count": row["gap_count"] or 0,
+                    "totalSeconds": row["gap_total_s"] or 0.0,
+                    "maxSeconds": row["max_gap_s"],
+                    "avgIntervalSeconds": row["avg_interval_s"],
+                },
+            }
+            for index, row in enumerate(trackers)
+        ],
+        "timeline": [dict(row, minute=minute) for row, minute in zip(timeline, minutes)],
+    }
+
+def get_gps_rollups(trackerId, start, end):
+    """Get the 1-minute rollups of a tracker in [start, end), oldest first"""
+    with get_read_connection() as conn:
+        rows = conn.execute('''
+        SELECT minute, messages, latitude, longitude, first_send_time, last_send_time,
+            latency_min, latency_max,
+            CASE WHEN latency_count THEN latency_sum / latency_count END AS latency_avg
+        FROM mqtt_gps_rollup_1m
+        WHERE tracker_id = ? AND minute >= ? AND minute < ?
+        ORDER BY minute
+        ''', (trackerId, to_epoch_us(start), to_epoch_us(end))).fetchall()
+    minutes = epoch_us_to_iso([row["minute"] for row in rows])
+    first_send_times = epoch_us_to_iso([row["first_send_time"] for row in rows])
+    last_send_times = epoch_us_to_iso([row["last_send_time"] for row in rows])
+    return [
+        {
+            "minute": minutes[index],
+            "messages": row["messages"],
+            "latitude": row["latitude"],
+            "longitude": row["longitude"],
+            "firstSendTime": first_send_times[index],
+            "lastSendTime": last_send_times[index],
+            "latencyMs": {"min": row["latency_min"], "max": row["latency_max"], "avg": row["latency_avg"]},
+        }
+        for index, row in enumerate(rows)
+    ]
 
 # Initialize the database when the module is imported
 init_db()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import os
+import signal
+import threading
+import logging
+from app.config.logging import configure_logging
+from app.config.mqtt import start_mqtt_client, stop_mqtt_client, clear_retained_messages
+from app.services.ingestService import start_ingest_pipeline, stop_ingest_pipeline
+from app.services.positionFeedService import start_position_feed_server, stop_position_feed_server
+from app.utils.time import start_ntp_refresher, stop_ntp_refresher
+
+logger = logging.getLogger(__name__)
+
+log_level = os.getenv("LOG_LEVEL", "INFO")
+configure_logging(log_level)
+
+
+def main():
+    """Run only the MQTT ingest pipeline, API processes get live positions over the position feed"""
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    # Startup
+    logger.info("Starting standalone ingest worker...")
+    start_ntp_refresher()
+    start_ingest_pipeline()
+    start_position_feed_server()
+    start_mqtt_client()
+    clear_retained_messages()
+
+    stop.wait()
+
+    # Shutdown
+    logger.info("Shutting down ingest worker...")
+    stop_mqtt_client()
+    # Drain whatever is still queued so the last positions reach the feed
+    stop_ingest_pipeline()
+    stop_position_feed_server()
+    stop_ntp_refresher()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
+# run the ingest worker using the command:
+# python -m app.ingest
@@ -14,13 +14,16 @@ from app.routers import (
     ocrRouter,
     adminRouter
 )
-from app.config.mqtt import start_mqtt_client, stop_mqtt_client, clear_retained_messages, set_socketio
+from app.config.mqtt import start_mqtt_client, stop_mqtt_client, clear_retained_messages, MQTT_SHARED_GROUP
+from app.services.ingestService import start_ingest_pipeline, stop_ingest_pipeline, INGEST_MODE
+from app.services.positionFeedService import start_position_feed_client, stop_position_feed_client
+from app.utils.time import start_ntp_refresher, stop_ntp_refresher
 from fastapi.exceptions import RequestValidationError
 import socketio
 import uvicorn
 import logging
 from fastapi.middleware.cors import CORSMiddleware
-from app.services.socketioService import sio
+from app.services.socketioService import sio, start_socketio_bridge, stop_socketio_bridge
 
 logger = logging.getLogger(__name__)
 
@@ -38,19 +41,42 @@ configure_logging(log_level)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle events"""
+    if INGEST_MODE != "remote" and MQTT_SHARED_GROUP:
+        # Each process would only see its own share of the trackers in Socket.IO and the position store
+        raise RuntimeError(
+            "MQTT_SHARED_GROUP needs INGEST_MODE=remote: run the shared ingest workers with python -m app.ingest"
+        )
     # Startup
     logger.info("Starting up application...")
-    # Start the MQTT client
-    start_mqtt_client()
-    # Clear retained messages
-    clear_retained_messages()
+    # Keep the NTP offset used for receive timestamps fresh in the background
+    start_ntp_refresher()
+    # Let the ingest threads hand Socket.IO events to this event loop
+    await start_socketio_bridge()
+    if INGEST_MODE == "remote":
+        # A standalone ingest worker (python -m app.ingest) sends the live positions
+        await start_position_feed_client()
+    else:
+        # Start the ingest pipeline before messages can arrive
+        start_ingest_pipeline()
+        # Start the MQTT client
+        start_mqtt_client()
+        # Clear retained messages
+        clear_retained_messages()
     
     yield
     
     # Shutdown
     logger.info("Shutting down application...")
-    # Stop the MQTT client
-    stop_mqtt_client()
+    if INGEST_MODE == "remote":
+        await stop_position_feed_client()
+    else:
+        # Stop the MQTT client
+        stop_mqtt_client()
+        # Drain whatever is still queued in the ingest pipeline
+        stop_ingest_pipeline()
+    # Emit the last queued Socket.IO events
+    await stop_socketio_bridge()
+    stop_ntp_refresher()
 
 app = FastAPI(
     title="Lokatani GPS Tracking API",
@@ -62,9 +88,6 @@ app = FastAPI(
 # Create an ASGI app by wrapping the FastAPI app with SocketIO
 server = socketio.ASGIApp(sio, app)
 
-# Pass the Socket.IO instance to the MQTT module
-set_socketio(sio)
-
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -1,6 +1,8 @@
+from dataclasses import dataclass, field
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime, timezone
+from datetime import datetime
+from app.utils.time import parse_gps_timestamp
 
 
 class GPSDataModel(BaseModel):
@@ -19,3 +21,19 @@ class GPSDataModel(BaseModel):
                 "satellites": 99,
             }
         }
+
+
+@dataclass(slots=True)
+class GPSRecord:
+    """Decoded GPS fix shared by every ingest stage, validated straight from JSON bytes"""
+    id: str
+    lat: float
+    long: float
+    timestamp: str
+    satellites: Optional[int] = None
+    iteration: Optional[int] = None
+    # Parsed once here so later stages never parse the timestamp string again
+    send_time: Optional[datetime] = field(default=None, init=False)
+
+    def __post_init__(self):
+        self.send_time = parse_gps_timestamp(self.timestamp)
@@ -2,14 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Body, Path
 from app.utils.auth import get_current_user
 from fastapi.responses import JSONResponse
 from typing import List, Optional, Dict, Any
+from datetime import datetime
 from app.services.adminService import (
     getAllUsers,
     assign_tracker_service,
     get_all_delivery_packages_service,
     get_admin_dashboard_service,
     getGPSData,
+    queryGPSData,
+    getIngestStats,
+    getLatencyStats,
+    getGPSRollups,
 )
-from app.config.sqlite import get_recent_gps_data
 from typing import Optional
 
 router = APIRouter(prefix="/api/v1/admin", tags=["Administrator"])
@@ -114,14 +118,86 @@ async def get_all_deliveries(
 async def get_gps_data(
     trackerId: Optional[str] = Query(None, description="Filter by tracker ID"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of records to return"),
+    columnar: bool = Query(False, description="Return one array per field instead of one object per record"),
     currentUser: dict = Depends(get_current_user)
 ):
     """Get recent GPS data from SQLite database"""
     try:      
-        result = await getGPSData(trackerId, limit, currentUser)
+        result = await getGPSData(trackerId, limit, currentUser, columnar)
         return result
     except HTTPException as e:
         return JSONResponse(
             status_code=e.status_code,
             content=e.detail
-        )
\ No newline at end of file
+        )
+
+@router.get("/gps-data/query", status_code=200)
+async def query_gps_data(
+    trackerId: Optional[str] = Query(None, description="Filter by tracker ID"),
+    start: Optional[datetime] = Query(None, description="Receive time from (ISO 8601, UTC if no offset)"),
+    end: Optional[datetime] = Query(None, description="Receive time until, exclusive (ISO 8601, UTC if no offset)"),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of records per page"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="asc (oldest first) or desc (newest first)"),
+    columnar: bool = Query(False, description="Return one array per field instead of one object per record"),
+    currentUser: dict = Depends(get_current_user)
+):
+    """Page through GPS data in SQLite by tracker and time range"""
+    try:
+        result = await queryGPSData(currentUser, trackerId, start, end, cursor, limit, order, columnar)
+        return result
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content=e.detail
+        )
+
+@router.get("/latency-stats", status_code=200)
+async def get_latency_stats(
+    start: Optional[datetime] = Query(None, description="Window start (ISO 8601, UTC if no offset), default one hour before end"),
+    end: Optional[datetime] = Query(None, description="Window end (ISO 8601, UTC if no offset), default now"),
+    trackerId: Optional[str] = Query(None, description="Filter by tracker ID"),
+    gapSeconds: float = Query(60, gt=0, description="Seconds between two fixes that count as a reporting gap"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of trackers to return, worst p95 latency first"),
+    currentUser: dict = Depends(get_current_user)
+):
+    """Get per-tracker and fleet-wide latency percentiles, message rates and gaps from SQLite"""
+    try:
+        result = await getLatencyStats(currentUser, start, end, trackerId, gapSeconds, limit)
+        return result
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content=e.detail
+        )
+
+@router.get("/gps-rollups", status_code=200)
+async def get_gps_rollups(
+    trackerId: str = Query(..., description="Tracker ID"),
+    start: Optional[datetime] = Query(None, description="Window start (ISO 8601, UTC if no offset), default one day before end"),
+    end: Optional[datetime] = Query(None, description="Window end (ISO 8601, UTC if no offset), default now"),
+    currentUser: dict = Depends(get_current_user)
+):
+    """Get per-minute GPS rollups of a tracker from SQLite"""
+    try:
+        result = await getGPSRollups(currentUser, trackerId, start, end)
+        return result
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content=e.detail
+        )
+
+@router.get("/ingest-stats", status_code=200)
+async def get_ingest_stats(
+    currentUser: dict = Depends(get_current_user)
+):
+    """Get GPS ingest pipeline and tracker write coalescing counters"""
+    try:
+        result = await getIngestStats(currentUser)
+        return result
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content=e.detail
+        )
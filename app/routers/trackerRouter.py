@@ -1,15 +1,34 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import JSONResponse, Response
 from app.utils.auth import get_current_user
 from app.services.mqttService import process_gps_data
 from app.models.mqttModel import GPSDataModel
 from app.config.firestore import db
 from google.cloud.firestore import FieldFilter
-from typing import List, Dict
-from app.services.trackerService import getTrackerLocation, getAllTracker, getTrackerDailyHistory
+from typing import List, Dict, Optional
+from app.services.trackerService import getTrackerLocation, getAllTracker, getTrackerDailyHistory, getTrackerSnapshot
 
 router = APIRouter(prefix="/api/v1", tags=["GPS Tracker"])
 
+# Declared before /trackers/{trackerId} so "snapshot" isn't taken as a tracker id
+@router.get("/trackers/snapshot")
+async def get_tracker_snapshot(
+    currentUser: dict = Depends(get_current_user),
+    ifNoneMatch: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """Get the latest position of every tracker in one compact response"""
+    try:
+        etag, result = await getTrackerSnapshot(currentUser, ifNoneMatch)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if result is None:
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=result, headers=headers)
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content=e.detail
+        )
+
 @router.get("/trackers/{trackerId}")
 async def get_tracker_location(trackerId: str, currentUser: dict = Depends(get_current_user)):
     """Get info and latest location of a specific tracker"""
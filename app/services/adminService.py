@@ -7,11 +7,24 @@ from app.utils.time import convert_utc_to_wib
 from google.cloud.firestore import FieldFilter, DELETE_FIELD
 import logging
 from fastapi import Query
-from app.config.sqlite import get_recent_gps_data
+from app.config.sqlite import (
+    get_recent_gps_columns,
+    query_gps_columns,
+    decode_gps_cursor,
+    gps_columns_to_json,
+    get_latency_stats,
+    get_gps_rollups,
+    run_sqlite_read,
+)
+from app.services.ingestService import get_ingest_stats
+from app.services.positionService import invalidate_tracker_info
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# Longest window the latency analytics and rollup reads may scan
+LATENCY_STATS_MAX_DAYS = 31
+
 # async def getAllUsers(currentUser):
 #     try : 
 #         # Check if user is admin
@@ -425,6 +438,7 @@ async def assign_tracker_service (userId, trackerId, currentUser):
                 })
                 username.append(user_data.get("username"))
                 logger.info(f"Removed tracker {trackerId} from user {user_doc.id}")
+            invalidate_tracker_info()
             
             return {
                 "status": "success",
@@ -498,6 +512,7 @@ async def assign_tracker_service (userId, trackerId, currentUser):
             "trackerId": trackerId,
             "lastUpdate": datetime.now(timezone.utc)
         })
+        invalidate_tracker_info()
         
         return {
             "status": "success",
@@ -628,7 +643,7 @@ async def get_all_delivery_packages_service(currentUser, status=None, driver_id=
             }
         )
 
-async def getGPSData(trackerId, limit, currentUser):
+async def getGPSData(trackerId, limit, currentUser, columnar=False):
     """Get recent GPS data from SQLite database"""
     try:
         # Check if user is admin
@@ -641,19 +656,266 @@ async def getGPSData(trackerId, limit, currentUser):
                     "timestamp": datetime.now(timezone.utc).isoformat()
                 }
             )
-        data = get_recent_gps_data(trackerId=trackerId, limit=limit)
+        columns = gps_columns_to_json(await run_sqlite_read(get_recent_gps_columns, trackerId=trackerId, limit=limit))
+        if columnar:
+            # One list per field, much smaller and faster to build than one object per row
+            data = {
+                "fields": list(columns),
+                "columns": columns,
+                "count": len(columns["id"])
+            }
+        else:
+            gps_data = [dict(zip(columns, row)) for row in zip(*columns.values())]
+            data = {
+                "gps_data": gps_data,
+                "count": len(gps_data)
+            }
+        return {
+            "status": "success",
+            "message": "GPS data retrieved successfully",
+            "data": data
+        }
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        logger.warning(f"Timed out while retrieving GPS data: {str(e)}")
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "fail",
+                "message": "Waktu query habis, persempit rentang waktu atau kurangi limit",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error while retrieving GPS data: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "fail",
+                "message": f"Terjadi kesalahan: {str(e)}",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+
+async def queryGPSData(currentUser, trackerId=None, start=None, end=None, cursor=None, limit=100, order="asc", columnar=False):
+    """Page through raw GPS data in SQLite by time range, pass nextCursor back to get the next page"""
+    try:
+        # Check if user is admin
+        if currentUser["role"] not in ["admin"]:
+            raise HTTPException(
+                status_code=403,
+                detail={
+                    "status": "fail",
+                    "message": "Anda tidak memiliki akses!",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        # Naive times are taken as UTC
+        if start and start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if end and end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        if start and end and start >= end:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": "Waktu mulai harus sebelum waktu selesai",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        try:
+            after = decode_gps_cursor(cursor, order) if cursor else None
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": "Cursor tidak valid",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        columns, nextCursor = await run_sqlite_read(
+            query_gps_columns, trackerId=trackerId, start=start, end=end, after=after, limit=limit, order=order
+        )
+
+        columns = gps_columns_to_json(columns)
+        data = {
+            "count": len(columns["id"]),
+            "nextCursor": nextCursor,
+        }
+        if columnar:
+            data["fields"] = list(columns)
+            data["columns"] = columns
+        else:
+            data["gps_data"] = [dict(zip(columns, row)) for row in zip(*columns.values())]
         return {
             "status": "success",
             "message": "GPS data retrieved successfully",
+            "data": data
+        }
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        logger.warning(f"Timed out while querying GPS data: {str(e)}")
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "fail",
+                "message": "Waktu query habis, persempit rentang waktu atau kurangi limit",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error while querying GPS data: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "fail",
+                "message": f"Terjadi kesalahan: {str(e)}",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+
+async def getLatencyStats(currentUser, start=None, end=None, trackerId=None, gapSeconds=60, limit=100):
+    """Get latency percentiles, message rates and reporting gaps per tracker and for the fleet"""
+    try:
+        # Check if user is admin
+        if currentUser["role"] not in ["admin"]:
+            raise HTTPException(
+                status_code=403,
+                detail={
+                    "status": "fail",
+                    "message": "Anda tidak memiliki akses!",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        # Default to the last hour, naive times are taken as UTC
+        end = end or datetime.now(timezone.utc)
+        start = start or end - timedelta(hours=1)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+
+        if start >= end:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": "Waktu mulai harus sebelum waktu selesai",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+        if end - start > timedelta(days=LATENCY_STATS_MAX_DAYS):
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": f"Rentang waktu maksimal {LATENCY_STATS_MAX_DAYS} hari",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        data = await run_sqlite_read(get_latency_stats, start, end, trackerId=trackerId, gapSeconds=gapSeconds, limit=limit)
+        return {
+            "status": "success",
+            "message": "Latency statistics retrieved successfully",
+            "data": data
+        }
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        logger.warning(f"Timed out while retrieving latency statistics: {str(e)}")
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "fail",
+                "message": "Waktu query habis, persempit rentang waktu atau kurangi limit",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error while retrieving latency statistics: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "fail",
+                "message": f"Terjadi kesalahan: {str(e)}",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+
+async def getGPSRollups(currentUser, trackerId, start=None, end=None):
+    """Get the 1-minute GPS rollups of a tracker, kept longer than the raw data"""
+    try:
+        # Check if user is admin
+        if currentUser["role"] not in ["admin"]:
+            raise HTTPException(
+                status_code=403,
+                detail={
+                    "status": "fail",
+                    "message": "Anda tidak memiliki akses!",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        # Default to the last day, naive times are taken as UTC
+        end = end or datetime.now(timezone.utc)
+        start = start or end - timedelta(days=1)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+
+        if start >= end:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": "Waktu mulai harus sebelum waktu selesai",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+        if end - start > timedelta(days=LATENCY_STATS_MAX_DAYS):
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "status": "fail",
+                    "message": f"Rentang waktu maksimal {LATENCY_STATS_MAX_DAYS} hari",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+
+        data = await run_sqlite_read(get_gps_rollups, trackerId, start, end)
+        return {
+            "status": "success",
+            "message": "GPS rollups retrieved successfully",
             "data": {
-                "gps_data": data,
+                "trackerId": trackerId,
+                "rollups": data,
                 "count": len(data)
             }
         }
     except HTTPException:
         raise
+    except TimeoutError as e:
+        logger.warning(f"Timed out while retrieving GPS rollups: {str(e)}")
+        raise HTTPException(
+            status_code=504,
+            detail={
+                "status": "fail",
+                "message": "Waktu query habis, persempit rentang waktu atau kurangi limit",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
     except Exception as e:
-        logger.error(f"Error while retrieving GPS data: {str(e)}")
+        logger.error(f"Error while retrieving GPS rollups: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail={
@@ -661,4 +923,35 @@ async def getGPSData(trackerId, limit, currentUser):
                 "message": f"Terjadi kesalahan: {str(e)}",
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
-        )
\ No newline at end of file
+        )
+
+async def getIngestStats(currentUser):
+    """Get GPS ingest pipeline counters"""
+    try:
+        # Check if user is admin
+        if currentUser["role"] not in ["admin"]:
+            raise HTTPException(
+                status_code=403,
+                detail={
+                    "status": "fail",
+                    "message": "Anda tidak memiliki akses!",
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                }
+            )
+        return {
+            "status": "success",
+            "message": "Ingest statistics retrieved successfully",
+            "data": get_ingest_stats()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error while retrieving ingest statistics: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "fail",
+                "message": f"Terjadi kesalahan: {str(e)}",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
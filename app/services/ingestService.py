@@ -0,0 +1,541 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from dotenv import load_dotenv
+from app.services.mqttService import (
+    process_gps_batch,
+    refresh_known_trackers,
+    has_pending_tracker_updates,
+    get_coalescing_stats,
+    get_history_stats,
+)
+from app.services.socketioService import (
+    emit_socketio_event,
+    publish_location,
+    get_socketio_stats,
+    tracker_room,
+    ALL_TRACKERS_ROOM,
+    SOCKETIO_PER_FIX_EVENTS,
+)
+from app.services.positionService import update_position
+from app.services.positionFeedService import publish_feed_location, get_position_feed_stats
+from app.utils.decrypt import decrypt_payloads, is_binary_payload
+from app.utils.decode import decode_gps_record, decode_binary_gps_record
+from app.utils.time import get_ntp_status, get_accurate_time, parse_gps_timestamp
+from app.utils.trackerQueue import TrackerQueue, TRACKER_QUEUE_POLICIES
+from app.config.sqlite import (
+    store_gps_batch,
+    start_gps_writer,
+    stop_gps_writer,
+    start_gps_maintenance,
+    stop_gps_maintenance,
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# embedded: the API process runs MQTT ingest itself, remote: it gets live positions
+# from a standalone ingest process (python -m app.ingest) over the position feed
+INGEST_MODE = os.getenv("INGEST_MODE", "embedded").lower()
+
+# Ingest pipeline configuration
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 200))
+INGEST_BATCH_WAIT_MS = int(os.getenv("INGEST_BATCH_WAIT_MS", 50))
+FIRESTORE_QUEUE_SIZE = int(os.getenv("FIRESTORE_QUEUE_SIZE", 10000))
+FIRESTORE_BATCH_SIZE = int(os.getenv("FIRESTORE_BATCH_SIZE", 200))
+FIRESTORE_BATCH_WAIT_MS = int(os.getenv("FIRESTORE_BATCH_WAIT_MS", 500))
+# What a full ingest queue does: drop_newest, drop_oldest or block (up to INGEST_BLOCK_TIMEOUT_MS)
+INGEST_QUEUE_POLICY = os.getenv("INGEST_QUEUE_POLICY", "drop_newest").lower()
+INGEST_BLOCK_TIMEOUT_MS = int(os.getenv("INGEST_BLOCK_TIMEOUT_MS", 1000))
+# What the Firestore queue does: drop_newest, drop_oldest_per_tracker or keep_latest.
+# SQLite archives every fix before this queue, so shedding here only thins Firestore history.
+FIRESTORE_QUEUE_POLICY = os.getenv("FIRESTORE_QUEUE_POLICY", "drop_oldest_per_tracker").lower()
+# How many recent (tracker, iteration) pairs are remembered to catch retransmits
+SEQUENCE_WINDOW_SIZE = int(os.getenv("SEQUENCE_WINDOW_SIZE", 100000))
+
+if INGEST_QUEUE_POLICY not in ("drop_newest", "drop_oldest", "block"):
+    logger.warning(f"Unknown INGEST_QUEUE_POLICY '{INGEST_QUEUE_POLICY}', using drop_newest")
+    INGEST_QUEUE_POLICY = "drop_newest"
+if FIRESTORE_QUEUE_POLICY not in TRACKER_QUEUE_POLICIES:
+    logger.warning(f"Unknown FIRESTORE_QUEUE_POLICY '{FIRESTORE_QUEUE_POLICY}', using drop_oldest_per_tracker")
+    FIRESTORE_QUEUE_POLICY = "drop_oldest_per_tracker"
+
+# Raw MQTT payloads waiting to be decoded: (payload bytes, receive time)
+_ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+# Validated fixes waiting to be written to Firestore: (gps data, late) per tracker
+_firestore_queue = TrackerQueue(FIRESTORE_QUEUE_SIZE, FIRESTORE_QUEUE_POLICY)
+
+# Each worker has its own stop event so shutdown can drain the stages in order
+_ingest_stop = threading.Event()
+_firestore_stop = threading.Event()
+_workers = []
+
+_stats_lock = threading.Lock()
+_stats = {
+    "received": 0,
+    "dropped": 0,
+    "processed": 0,
+    "failed": 0,
+    "firestoreDropped": 0,
+    "firestoreFailed": 0,
+    "duplicates": 0,
+    "late": 0,
+    "binaryPayloads": 0,
+    "blocked": 0,
+    "droppedOldest": 0,
+    "ingestLagMs": 0.0,
+    "maxIngestLagMs": 0.0,
+    "firestoreLagMs": 0.0,
+    "maxFirestoreLagMs": 0.0,
+}
+
+# Time spent per pipeline stage, per call and per message
+_stage_stats = {}
+
+# Recently seen (tracker, iteration) -> device timestamp, oldest first
+_seen_iterations = OrderedDict()
+# Newest device time accepted per tracker
+_latest_send_time = {}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _record_stage(name, started, messages):
+    """Add the time since started (perf_counter) to a pipeline stage's timing counters"""
+    elapsedMs = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        stage = _stage_stats.setdefault(name, {"calls": 0, "messages": 0, "totalMs": 0.0, "maxMs": 0.0})
+        stage["calls"] += 1
+        stage["messages"] += messages
+        stage["totalMs"] += elapsedMs
+        stage["maxMs"] = max(stage["maxMs"], elapsedMs)
+
+
+def _record_lag(name, lagMs):
+    """Keep the last and the worst processing lag of a stage"""
+    maxName = "max" + name[0].upper() + name[1:]
+    with _stats_lock:
+        _stats[name] = lagMs
+        _stats[maxName] = max(_stats[maxName], lagMs)
+
+
+def get_ingest_stats():
+    """Get a snapshot of the ingest pipeline counters and queue depths"""
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["stages"] = {
+            name: {
+                **stage,
+                "avgMsPerMessage": stage["totalMs"] / stage["messages"] if stage["messages"] else 0.0,
+            }
+            for name, stage in _stage_stats.items()
+        }
+    stats["queueDepth"] = _ingest_queue.qsize()
+    stats["queuePolicy"] = INGEST_QUEUE_POLICY
+    stats["firestoreQueueDepth"] = _firestore_queue.qsize()
+    stats["firestoreQueuePolicy"] = FIRESTORE_QUEUE_POLICY
+    stats["trackerWrites"] = get_coalescing_stats()
+    stats["history"] = get_history_stats()
+    stats["socketio"] = get_socketio_stats()
+    stats["ntp"] = get_ntp_status()
+    stats["positionFeed"] = get_position_feed_stats()
+    return stats
+
+
+def enqueue_gps_message(payload, receive_time):
+    """Hand a raw MQTT payload over to the ingest pipeline, a full queue is handled by INGEST_QUEUE_POLICY"""
+    item = (payload, receive_time)
+    try:
+        _ingest_queue.put_nowait(item)
+        _count("received")
+        return True
+    except queue.Full:
+        pass
+
+    if INGEST_QUEUE_POLICY == "block":
+        # Stalls the MQTT network thread, so the broker and the TCP window buffer instead of us
+        _count("blocked")
+        try:
+            _ingest_queue.put(item, timeout=INGEST_BLOCK_TIMEOUT_MS / 1000)
+            _count("received")
+            return True
+        except queue.Full:
+            pass
+    elif INGEST_QUEUE_POLICY == "drop_oldest":
+        try:
+            _ingest_queue.get_nowait()
+            _count("droppedOldest")
+        except queue.Empty:
+            pass
+        try:
+            _ingest_queue.put_nowait(item)
+            _count("received")
+            return True
+        except queue.Full:
+            pass
+
+    _count("dropped")
+    logger.warning("Ingest queue is full, dropping GPS message")
+    return False
+
+
+def _log_ingest_error(e, data=None):
+    """Log an ingest error with a short message depending on its type"""
+    # Get exception type name
+    error_type = type(e).__name__
+
+    # Handle different types of errors differently
+    if "ValidationError" in error_type:
+        # For Pydantic validation errors, show exactly which fields failed
+        error_details = str(e).split("\n")[1:3]  # Take just the key parts
+        logger.error(f"MQTT data validation failed: {' | '.join(error_details)}")
+
+        # Log the received data for debugging (optional)
+        if isinstance(data, dict):
+            logger.debug(f"Invalid data received from tracker: {data.get('id', 'unknown')}")
+
+    elif "KeyError" in error_type:
+        # For missing keys
+        logger.error(f"Missing required field in MQTT message: {str(e)}")
+
+    elif "JSONDecodeError" in error_type:
+        # For JSON parsing errors
+        logger.error(f"Invalid JSON format in MQTT message")
+
+    elif "AttributeError" in error_type:
+        # For attribute errors (typically when trying to access attributes of None)
+        logger.error(f"MQTT processing error: Unexpected data structure")
+
+    else:
+        # For other errors, provide a cleaner message
+        logger.error(f"MQTT processing error ({error_type}): {str(e)[:100]}")
+
+    # For debugging, you can log the full error to debug level
+    logger.debug(f"Full error details: {str(e)}")
+
+
+def _latency_ms(receive_time, send_time, trackerId):
+    """Device to server latency in milliseconds, None if it can't be computed"""
+    try:
+        # Hitung latency dalam milidetik
+        latency_ms = (receive_time - send_time).total_seconds() * 1000
+        logger.debug(f"MQTT Latency\t: {latency_ms:.2f}ms for message from {trackerId}")
+        return latency_ms
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Could not calculate latency: {e}")
+        return None
+
+
+def _decode_invalid(decrypted_bytes, receive_time):
+    """Parse a payload that failed validation so it can still be archived, None if it isn't an object"""
+    try:
+        data = json.loads(decrypted_bytes)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    send_time = None
+    latency_ms = None
+    # Jika ada timestamp di pesan, hitung latency
+    if isinstance(data.get("timestamp"), str):
+        try:
+            send_time = parse_gps_timestamp(data["timestamp"])
+            latency_ms = _latency_ms(receive_time, send_time, data.get("id", "unknown"))
+        except ValueError as e:
+            logger.warning(f"Could not calculate latency: {e}")
+            send_time = None
+
+    return {
+        "gps_data": None,
+        "data": data,
+        "receive_time": receive_time,
+        "send_time": send_time,
+        "latency_ms": latency_ms,
+    }
+
+
+def _decode_stage(messages):
+    """Decrypt payloads, decode them into validated GPS records and compute the latency"""
+    # Decrypt the whole micro-batch with one keystream call, hex and binary payloads alike
+    payloads = decrypt_payloads([payload for payload, _ in messages])
+
+    decoded = []
+    for (payload, receive_time), decrypted_bytes in zip(messages, payloads):
+        if decrypted_bytes is None:
+            _count("failed")
+            continue
+        try:
+            if is_binary_payload(payload):
+                _count("binaryPayloads")
+                gps_data = decode_binary_gps_record(decrypted_bytes)
+            else:
+                # JSON parsing, validation and timestamp parsing in one pass
+                gps_data = decode_gps_record(decrypted_bytes)
+        except Exception as e:
+            # Invalid messages are still archived locally but go no further
+            _count("failed")
+            record = _decode_invalid(decrypted_bytes, receive_time)
+            _log_ingest_error(e, record["data"] if record else None)
+            if record:
+                decoded.append(record)
+            continue
+
+        decoded.append(
+            {
+                "gps_data": gps_data,
+                "receive_time": receive_time,
+                "send_time": gps_data.send_time,
+                "latency_ms": _latency_ms(receive_time, gps_data.send_time, gps_data.id),
+            }
+        )
+    return decoded
+
+
+def _record_identity(record):
+    """(tracker id, iteration, timestamp) of a decoded record"""
+    gps_data = record["gps_data"]
+    if gps_data:
+        return gps_data.id, gps_data.iteration, gps_data.timestamp
+    data = record["data"]
+    return data.get("id"), data.get("iteration"), data.get("timestamp")
+
+
+def _sequence_stage(records):
+    """Drop retransmitted fixes and mark fixes older than the tracker's newest one as late"""
+    sequenced = []
+    for record in records:
+        trackerId, iteration, timestamp = _record_identity(record)
+
+        # Invalid records carry raw JSON values, a list or object can't be part of a key
+        if isinstance(trackerId, (str, int)) and isinstance(iteration, (str, int)):
+            key = (trackerId, iteration)
+            # Same iteration and timestamp is a QoS retransmit, a new timestamp means the device restarted its counter
+            if key in _seen_iterations and _seen_iterations[key] == timestamp:
+                _seen_iterations.move_to_end(key)
+                _count("duplicates")
+                continue
+            _seen_iterations[key] = timestamp
+            _seen_iterations.move_to_end(key)
+            if len(_seen_iterations) > SEQUENCE_WINDOW_SIZE:
+                _seen_iterations.popitem(last=False)
+
+        record["late"] = False
+        send_time = record["send_time"]
+        if record["gps_data"] and send_time:
+            if send_time.tzinfo is None:
+                send_time = send_time.replace(tzinfo=timezone.utc)
+            latest = _latest_send_time.get(trackerId)
+            if latest and send_time < latest:
+                record["late"] = True
+                _count("late")
+            else:
+                _latest_send_time[trackerId] = send_time
+        sequenced.append(record)
+    return sequenced
+
+
+def _persist_stage(records):
+    """Store every decoded message in SQLite as the raw local record"""
+    rows = []
+    for record in records:
+        gps_data = record["gps_data"]
+        if gps_data:
+            trackerId, lat, lon, iteration = gps_data.id, gps_data.lat, gps_data.long, gps_data.iteration
+        else:
+            data = record["data"]
+            trackerId, lat, lon, iteration = data.get("id"), data.get("lat"), data.get("long"), data.get("iteration")
+        rows.append(
+            (
+                trackerId,
+                lat,
+                lon,
+                record["receive_time"],
+                record["send_time"],
+                record["latency_ms"],
+                iteration,
+            )
+        )
+    # The SQLite writer group-commits these together with other batches
+    store_gps_batch(rows)
+
+
+def _broadcast_stage(records):
+    """Hand the new locations to the position store and the Socket.IO broadcaster"""
+    for record in records:
+        if record["late"]:
+            continue
+        gps_data = record["gps_data"]
+        send_time = record["send_time"]
+        timestampMs = int(send_time.timestamp() * 1000) if send_time else None
+        if send_time:
+            update_position(gps_data.id, gps_data.lat, gps_data.long, send_time)
+        publish_location(gps_data.id, gps_data.lat, gps_data.long, timestampMs)
+        # Only does something in a standalone ingest process serving API processes
+        publish_feed_location(gps_data.id, gps_data.lat, gps_data.long, timestampMs)
+
+        if SOCKETIO_PER_FIX_EVENTS:
+            websocket_data = {
+                "trackerId": gps_data.id,
+                "location": {
+                    "latitude": gps_data.lat,
+                    "longitude": gps_data.long,
+                },
+                "timestamp": gps_data.timestamp,
+            }
+            emit_socketio_event(
+                "tracker:location_update",
+                websocket_data,
+                room=[tracker_room(gps_data.id), ALL_TRACKERS_ROOM],
+            )
+
+
+def _firestore_stage(records):
+    """Queue fixes for the Firestore worker so a slow commit never stalls local ingest"""
+    for record in records:
+        gps_data = record["gps_data"]
+        if record["late"] and FIRESTORE_QUEUE_POLICY == "keep_latest":
+            # Late fixes would only add history, which keep_latest leaves to SQLite
+            _count("firestoreDropped")
+            continue
+        dropped = _firestore_queue.put(gps_data.id, (gps_data, record["late"]))
+        if dropped:
+            _count("firestoreDropped", dropped)
+            logger.debug(f"Firestore queue shed {dropped} fix(es) of tracker {gps_data.id}")
+
+
+def _drain_batch(source, batch_size, wait_ms):
+    """Block briefly for the first item, then collect up to batch_size items within wait_ms"""
+    try:
+        batch = [source.get(timeout=0.5)]
+    except queue.Empty:
+        return []
+
+    deadline = time.monotonic() + wait_ms / 1000
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(source.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def process_message_batch(messages):
+    """Run one micro-batch of raw messages through every pipeline stage"""
+    # Time the oldest message spent waiting for the ingest worker
+    oldest = min(receive_time for _, receive_time in messages)
+    _record_lag("ingestLagMs", max(0.0, (get_accurate_time() - oldest).total_seconds() * 1000))
+
+    started = time.perf_counter()
+    records = _decode_stage(messages)
+    _record_stage("decode", started, len(messages))
+
+    started = time.perf_counter()
+    records = _sequence_stage(records)
+    _record_stage("sequence", started, len(records))
+
+    started = time.perf_counter()
+    try:
+        _persist_stage(records)
+    except Exception as e:
+        logger.error(f"Error persisting GPS batch: {str(e)}")
+    _record_stage("persist", started, len(records))
+
+    valid_records = [record for record in records if record["gps_data"]]
+
+    started = time.perf_counter()
+    try:
+        _broadcast_stage(valid_records)
+    except Exception as e:
+        logger.error(f"Error broadcasting GPS batch: {str(e)}")
+    _record_stage("broadcast", started, len(valid_records))
+
+    started = time.perf_counter()
+    _firestore_stage(valid_records)
+    _record_stage("firestoreQueue", started, len(valid_records))
+    _count("processed", len(valid_records))
+
+
+def _ingest_worker():
+    """Drain raw messages until stopped, finishing whatever is still queued"""
+    while not _ingest_stop.is_set() or not _ingest_queue.empty():
+        messages = _drain_batch(_ingest_queue, INGEST_BATCH_SIZE, INGEST_BATCH_WAIT_MS)
+        if messages:
+            try:
+                process_message_batch(messages)
+            except Exception:
+                # A bug in one stage must not stop ingest for good
+                logger.exception(f"Error processing a batch of {len(messages)} GPS messages")
+                _count("failed", len(messages))
+
+
+def _firestore_worker():
+    """Commit queued fixes to Firestore in micro-batches"""
+    # Warm the tracker registry here so startup doesn't wait on Firestore
+    refresh_known_trackers()
+    while not _firestore_stop.is_set() or not _firestore_queue.empty():
+        items = _drain_batch(_firestore_queue, FIRESTORE_BATCH_SIZE, FIRESTORE_BATCH_WAIT_MS)
+        gps_batch = [gps_data for (gps_data, late), _ in items if not late]
+        late_batch = [gps_data for (gps_data, late), _ in items if late]
+        # Also runs on idle loops so coalesced tracker updates get flushed once they are due
+        try:
+            if items or has_pending_tracker_updates():
+                started = time.perf_counter()
+                if not process_gps_batch(gps_batch, late_batch=late_batch):
+                    _count("firestoreFailed", len(items))
+                _record_stage("firestoreCommit", started, len(items))
+            if items:
+                # Queue wait plus commit time of the oldest fix in the batch
+                _record_lag("firestoreLagMs", (time.monotonic() - min(queuedAt for _, queuedAt in items)) * 1000)
+        except Exception:
+            logger.exception(f"Error committing a batch of {len(items)} GPS fixes to Firestore")
+            _count("firestoreFailed", len(items))
+
+    # Write out every coalesced update before shutting down
+    if has_pending_tracker_updates():
+        process_gps_batch([], flush_all=True)
+
+
+def start_ingest_pipeline():
+    """Start the ingest and Firestore worker threads"""
+    if _workers:
+        return
+    start_gps_writer()
+    # Rollups and retention of the SQLite store run next to the process that writes it
+    start_gps_maintenance()
+    for target, name, stop_event in (
+        (_ingest_worker, "gps-ingest", _ingest_stop),
+        (_firestore_worker, "gps-firestore", _firestore_stop),
+    ):
+        stop_event.clear()
+        worker = threading.Thread(target=target, name=name, daemon=True)
+        worker.start()
+        _workers.append((worker, stop_event))
+    logger.info("GPS ingest pipeline started")
+
+
+def stop_ingest_pipeline(timeout=10):
+    """Stop the worker threads after draining the queues"""
+    # Stop upstream stages first so nothing is queued behind a finished worker
+    for worker, stop_event in _workers:
+        stop_event.set()
+        worker.join(timeout=timeout)
+    _workers.clear()
+    stop_gps_maintenance(timeout=timeout)
+    stop_gps_writer(timeout=timeout)
+    logger.info("GPS ingest pipeline stopped")
@@ -1,145 +1,387 @@
 import logging
+import os
+import threading
+import time
 from datetime import datetime, timezone
+from dotenv import load_dotenv
+from google.api_core.exceptions import AlreadyExists, NotFound
 from google.cloud import firestore
 from app.config.firestore import db
 from app.models.mqttModel import GPSDataModel
+from app.utils.location import haversine_distance, initial_bearing, heading_difference
+from app.utils.time import parse_gps_timestamp
 from uuid_utils import uuid7
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# async def process_gps_data(gps_data: GPSDataModel):
-#     """Process GPS data received from MQTT and update Firestore"""
-#     try:
-#         if not db:
-#             logger.error("Firestore database not initialized")
-#             return False
-
-#         trackerId = gps_data.id
-#         geopoint = firestore.GeoPoint(gps_data.lat, gps_data.long)
-#         timestamp = datetime.fromisoformat(gps_data.timestamp)
-
-#         locationData = {
-#             # "location": {
-#             #     "latitude": gps_data.lat,
-#             #     "longitude": gps_data.long
-#             # },
-#             "location": geopoint,
-#             "lastUpdate": timestamp,
-#         }
-
-#         # Update the tracker document in Firestore
-#         trackerRef = db.collection("trackerCollection").document(trackerId)
-
-#         # Check if the tracker document exists
-#         trackerDoc = trackerRef.get()
-
-#         batch = db.batch()
-
-#         if trackerDoc.exists:
-#             # Update existing tracker document
-#             batch.update(trackerRef, locationData)
-#             # trackerRef.update(locationData)
-#             logger.debug(f"Updated location for tracker {trackerId}")
-#         else:
-#             # Create new tracker document with basic info
-#             tracker_data = {
-#                 "trackerId": trackerId,
-#                 "trackerName": f"GPS Tracker {trackerId}",
-#                 "registrationDate": datetime.now(timezone.utc),
-#                 **locationData,
-#             }
-#             batch.set(trackerRef, tracker_data)
-#             # trackerRef.set(tracker_data)
-#             logger.debug(f"Created new tracker record for {trackerId}")
-
-#         # save location to history
-#         # Create document with auto-generated ID in history subcollection
-#         historyData = {"location": geopoint, "timestamp": timestamp}
-
-#         historyId = str(uuid7())
-
-#         # save location to history
-#         historyRef = trackerRef.collection("locationHistory").document(historyId)
-#         # historyRef.set(locationHistory)
-#         batch.set(historyRef, historyData)
-
-#         # Commit all changes
-#         batch.commit()
-#         return True
-#     except Exception as e:
-#         logger.error(f"Error updating tracker location: {str(e)}")
-#         return False
+# Load environment variables
+load_dotenv()
+
+# How long the known-tracker registry is trusted before it is reloaded from Firestore
+TRACKER_REGISTRY_TTL = int(os.getenv("TRACKER_REGISTRY_TTL", 600))
+# Minimum seconds between two writes to the same tracker document (Firestore sustains ~1/s)
+TRACKER_WRITE_INTERVAL = float(os.getenv("TRACKER_WRITE_INTERVAL", 1.0))
+
+# History decimation: which fixes become locationHistory documents (SQLite keeps all of them)
+HISTORY_DECIMATION = os.getenv("HISTORY_DECIMATION", "true").lower() == "true"
+# Never write two history points closer together than this many seconds
+HISTORY_MIN_INTERVAL_S = float(os.getenv("HISTORY_MIN_INTERVAL_S", 5))
+# Keep a point once the tracker moved at least this far from the last kept point
+HISTORY_MIN_DISTANCE_M = float(os.getenv("HISTORY_MIN_DISTANCE_M", 25))
+# Keep a shorter move if the heading turned at least this much (corners), ignoring GPS jitter
+HISTORY_HEADING_CHANGE_DEG = float(os.getenv("HISTORY_HEADING_CHANGE_DEG", 30))
+HISTORY_NOISE_DISTANCE_M = float(os.getenv("HISTORY_NOISE_DISTANCE_M", 8))
+# Keep one point this often even when parked, so the history shows where it waited
+HISTORY_MAX_INTERVAL_S = float(os.getenv("HISTORY_MAX_INTERVAL_S", 300))
+
+# "documents" writes one locationHistory document per point,
+# "buckets" appends points to one locationBuckets document per tracker per UTC hour
+HISTORY_STORAGE_MODE = os.getenv("HISTORY_STORAGE_MODE", "documents").lower()
+
+# Firestore allows at most 500 writes per batch
+FIRESTORE_MAX_BATCH_WRITES = 500
+
+
+def gps_fix_time(gps_data):
+    """Device time of a fix, GPSRecords carry it already parsed"""
+    send_time = getattr(gps_data, "send_time", None)
+    return send_time if send_time is not None else parse_gps_timestamp(gps_data.timestamp)
 
 
 def process_gps_data(gps_data: GPSDataModel):
     """Non-async version for direct use in MQTT callbacks"""
+    return process_gps_batch([gps_data])
+
+
+# Tracker ids known to exist in trackerCollection, so updates don't need a read first
+_known_trackers = set()
+_known_trackers_loaded_at = 0
+_registry_lock = threading.Lock()
+
+
+def refresh_known_trackers():
+    """Reload the known-tracker registry from trackerCollection"""
+    global _known_trackers, _known_trackers_loaded_at
+    if not db:
+        return False
     try:
-        if not db:
-            logger.error("Firestore database not initialized")
-            return False
+        # Only document ids are needed, skip every field
+        trackerIds = {doc.id for doc in db.collection("trackerCollection").select([]).stream()}
+        with _registry_lock:
+            _known_trackers = trackerIds
+            _known_trackers_loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(trackerIds)} known trackers from Firestore")
+        return True
+    except Exception as e:
+        # Don't retry on every message, unseen ids fall back to create-if-missing meanwhile
+        _known_trackers_loaded_at = time.monotonic()
+        logger.error(f"Error loading known trackers: {str(e)}")
+        return False
+
+
+def register_tracker(trackerId):
+    """Mark a tracker as existing in trackerCollection"""
+    with _registry_lock:
+        _known_trackers.add(trackerId)
+
+
+def is_known_tracker(trackerId):
+    """Check the registry, reloading it first once the TTL has passed"""
+    if time.monotonic() - _known_trackers_loaded_at > TRACKER_REGISTRY_TTL:
+        refresh_known_trackers()
+    with _registry_lock:
+        return trackerId in _known_trackers
+
+
+def _create_tracker_if_missing(trackerRef, trackerId, locationData):
+    """Create the tracker document for an unseen id, returns False if it already existed"""
+    tracker_data = {
+        "trackerId": trackerId,
+        "trackerName": f"GPS Tracker {trackerId}",
+        "registrationDate": datetime.now(timezone.utc),
+        **locationData,
+    }
+    try:
+        trackerRef.create(tracker_data)
+        logger.debug(f"Created new tracker record for {trackerId}")
+    except AlreadyExists:
+        register_tracker(trackerId)
+        return False
+    # A failed create leaves the id unknown so the next flush tries again
+    register_tracker(trackerId)
+    return True
+
+
+# Newest location per tracker waiting for its next allowed write
+_pending_tracker_updates = {}
+_last_tracker_write = {}
+_coalesce_lock = threading.Lock()
+_coalesce_stats = {
+    "coalesced": 0,
+    "flushed": 0,
+    "lastFlushLagMs": 0.0,
+    "maxFlushLagMs": 0.0,
+}
+
+
+def history_bucket_id(timestamp):
+    """Id of the hourly history bucket a timestamp falls into, e.g. 2025051404 (UTC)"""
+    return timestamp.astimezone(timezone.utc).strftime("%Y%m%d%H")
+
+
+def history_bucket_point(lat, lon, timestamp):
+    """Compact history point stored inside a bucket document"""
+    return {"lat": lat, "lon": lon, "t": int(timestamp.timestamp() * 1000)}
+
+
+def _queue_tracker_update(trackerId, locationData, bucketPoint=None):
+    """Keep only the newest location/lastUpdate for a tracker until it is flushed, None only adds history"""
+    with _coalesce_lock:
+        pending = _pending_tracker_updates.get(trackerId)
+        if pending is None:
+            pending = _pending_tracker_updates[trackerId] = {
+                "locationData": locationData,
+                "bucketPoints": [],
+                "queuedAt": time.monotonic(),
+            }
+        elif locationData is not None:
+            _coalesce_stats["coalesced"] += 1
+            if (
+                pending["locationData"] is None
+                or locationData["lastUpdate"] >= pending["locationData"]["lastUpdate"]
+            ):
+                pending["locationData"] = locationData
+
+        # Bucket points ride along with the tracker update so each bucket gets at most one write per flush
+        if bucketPoint:
+            pending["bucketPoints"].append(bucketPoint)
+
 
-        trackerId = gps_data.id
-        geopoint = firestore.GeoPoint(gps_data.lat, gps_data.long)
-        # timestamp = datetime.fromisoformat(gps_data.timestamp)
-
-        # Handle timestamp with 'Z' suffix properly
-        timestamp_str = gps_data.timestamp
-        if timestamp_str.endswith('Z'):
-            # Replace Z with +00:00 (UTC)
-            timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        else:
-            timestamp = datetime.fromisoformat(timestamp_str)
-
-
-        # Prepare location data for Firestore
-        locationData = {
-            # "location": {
-            #     "latitude": gps_data.lat,
-            #     "longitude": gps_data.long
-            # },
-            "location": geopoint,
-            "lastUpdate": timestamp,
+def _take_due_tracker_updates(flush_all=False):
+    """Pop the pending updates whose tracker may be written again"""
+    now = time.monotonic()
+    due = []
+    with _coalesce_lock:
+        for trackerId, pending in list(_pending_tracker_updates.items()):
+            lastWrite = _last_tracker_write.get(trackerId, 0)
+            if not flush_all and now - lastWrite < TRACKER_WRITE_INTERVAL:
+                continue
+            del _pending_tracker_updates[trackerId]
+            _last_tracker_write[trackerId] = now
+
+            lagMs = (now - pending["queuedAt"]) * 1000
+            _coalesce_stats["flushed"] += 1
+            _coalesce_stats["lastFlushLagMs"] = lagMs
+            _coalesce_stats["maxFlushLagMs"] = max(_coalesce_stats["maxFlushLagMs"], lagMs)
+            due.append((trackerId, pending["locationData"], pending["bucketPoints"]))
+    return due
+
+
+def _requeue_tracker_updates(trackerWrites):
+    """Put popped updates and history points back after a failed commit, unless a newer location was queued meanwhile"""
+    with _coalesce_lock:
+        for trackerId, locationData, bucketPoints in trackerWrites:
+            pending = _pending_tracker_updates.get(trackerId)
+            if pending is None:
+                _pending_tracker_updates[trackerId] = {
+                    "locationData": locationData,
+                    "bucketPoints": list(bucketPoints),
+                    "queuedAt": time.monotonic(),
+                }
+                continue
+            if locationData is not None and (
+                pending["locationData"] is None
+                or locationData["lastUpdate"] > pending["locationData"]["lastUpdate"]
+            ):
+                pending["locationData"] = locationData
+            # Older points first, ArrayUnion skips the ones a partly committed flush already wrote
+            pending["bucketPoints"][:0] = bucketPoints
+
+
+def has_pending_tracker_updates():
+    """Check whether coalesced tracker updates are still waiting to be written"""
+    with _coalesce_lock:
+        return bool(_pending_tracker_updates)
+
+
+def get_coalescing_stats():
+    """Get the tracker write coalescing counters"""
+    with _coalesce_lock:
+        stats = dict(_coalesce_stats)
+        stats["pending"] = len(_pending_tracker_updates)
+    return stats
+
+
+# Last kept history point per tracker, used to decide whether a new fix is worth keeping
+_history_state = {}
+_history_stats = {"kept": 0, "skipped": 0}
+
+
+def _should_keep_history(trackerId, lat, lon, timestamp):
+    """Decide whether a fix becomes a history document based on time, distance and heading"""
+    if not HISTORY_DECIMATION:
+        return True
+
+    last = _history_state.get(trackerId)
+    keep = False
+    heading = None
+
+    if last is None:
+        keep = True
+    else:
+        elapsed = (timestamp - last["timestamp"]).total_seconds()
+        if elapsed >= HISTORY_MIN_INTERVAL_S:
+            distance = haversine_distance(last["lat"], last["lon"], lat, lon)
+            if distance >= HISTORY_NOISE_DISTANCE_M:
+                heading = initial_bearing(last["lat"], last["lon"], lat, lon)
+
+            if distance >= HISTORY_MIN_DISTANCE_M or elapsed >= HISTORY_MAX_INTERVAL_S:
+                keep = True
+            elif (
+                heading is not None
+                and last["heading"] is not None
+                and heading_difference(heading, last["heading"]) >= HISTORY_HEADING_CHANGE_DEG
+            ):
+                keep = True
+
+    if keep:
+        _history_state[trackerId] = {
+            "lat": lat,
+            "lon": lon,
+            "timestamp": timestamp,
+            # Keep the previous heading while parked so the next departure is compared to it
+            "heading": heading if heading is not None else (last or {}).get("heading"),
         }
-        # Update the tracker document in Firestore
-        trackerRef = db.collection("trackerCollection").document(trackerId)
+        _history_stats["kept"] += 1
+    else:
+        _history_stats["skipped"] += 1
+    return keep
+
 
-        # Check if the tracker document exists
-        trackerDoc = trackerRef.get()
+def get_history_stats():
+    """Get the history decimation counters"""
+    return dict(_history_stats)
 
-        # Start a batch write
-        batch = db.batch()
 
-        if trackerDoc.exists:
+def _commit_gps_writes(trackerWrites, historyWrites):
+    """Commit tracker updates and history points, splitting at the batch write limit"""
+    batch = db.batch()
+    writes = 0
+
+    def add_write():
+        nonlocal batch, writes
+        # Commit before the batch goes over the Firestore write limit
+        if writes == FIRESTORE_MAX_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            writes = 0
+        writes += 1
+
+    for trackerId, locationData, bucketPoints in trackerWrites:
+        trackerRef = db.collection("trackerCollection").document(trackerId)
+        if locationData is None:
+            # Only late history points, the tracker document keeps its newer location
+            pass
+        elif is_known_tracker(trackerId) or not _create_tracker_if_missing(
+            trackerRef, trackerId, locationData
+        ):
             # Update existing tracker document
+            add_write()
             batch.update(trackerRef, locationData)
-            # trackerRef.update(locationData)
             logger.debug(f"Updated location for tracker {trackerId}")
-        else:
-            # Create new tracker document with basic info
-            tracker_data = {
-                "trackerId": trackerId,
-                "trackerName": f"GPS Tracker {trackerId}",
-                "registrationDate": datetime.now(timezone.utc),
-                **locationData,
-            }
-            batch.set(trackerRef, tracker_data)
-            # trackerRef.set(tracker_data)
-            logger.debug(f"Created new tracker record for {trackerId}")
-
-        historyData = {"location": geopoint, "timestamp": timestamp}
 
-        # Generate UUIDv7 (timestamp-based)
-        historyId = str(uuid7())
+        # Append the points of each hour to its bucket, creating the bucket if needed
+        buckets = {}
+        for point in bucketPoints:
+            pointTime = datetime.fromtimestamp(point["t"] / 1000, timezone.utc)
+            buckets.setdefault(history_bucket_id(pointTime), []).append(point)
+        for bucketId, points in buckets.items():
+            bucketStart = datetime.strptime(bucketId, "%Y%m%d%H").replace(tzinfo=timezone.utc)
+            bucketRef = trackerRef.collection("locationBuckets").document(bucketId)
+            add_write()
+            batch.set(
+                bucketRef,
+                {"start": bucketStart, "points": firestore.ArrayUnion(points)},
+                merge=True,
+            )
 
+    for trackerId, historyId, historyData in historyWrites:
         # save location to history
-        historyRef = trackerRef.collection("locationHistory").document(historyId)
-        # historyRef.set(locationHistory)
+        historyRef = (
+            db.collection("trackerCollection")
+            .document(trackerId)
+            .collection("locationHistory")
+            .document(historyId)
+        )
+        add_write()
         batch.set(historyRef, historyData)
 
-        # Commit all changes
+    # Commit all remaining changes
+    if writes:
         batch.commit()
 
+
+def process_gps_batch(gps_batch, flush_all=False, late_batch=None):
+    """Write a micro-batch of GPS fixes to Firestore, late fixes only become history"""
+    try:
+        if not db:
+            logger.error("Firestore database not initialized")
+            return False
+
+        historyWrites = []
+        # Late fixes arrived after a newer one of the same tracker, they must not move lastUpdate
+        for gps_data in late_batch or []:
+            timestamp = gps_fix_time(gps_data)
+            # Decimation state follows the live track, so late points skip it
+            if HISTORY_STORAGE_MODE == "buckets":
+                _queue_tracker_update(
+                    gps_data.id, None, history_bucket_point(gps_data.lat, gps_data.long, timestamp)
+                )
+            else:
+                historyData = {
+                    "location": firestore.GeoPoint(gps_data.lat, gps_data.long),
+                    "timestamp": timestamp,
+                }
+                historyWrites.append((gps_data.id, str(uuid7()), historyData))
+
+        for gps_data in gps_batch:
+            trackerId = gps_data.id
+            geopoint = firestore.GeoPoint(gps_data.lat, gps_data.long)
+            timestamp = gps_fix_time(gps_data)
+
+            # Only fixes that show movement (or a periodic heartbeat) become history points
+            bucketPoint = None
+            if _should_keep_history(trackerId, gps_data.lat, gps_data.long, timestamp):
+                if HISTORY_STORAGE_MODE == "buckets":
+                    bucketPoint = history_bucket_point(gps_data.lat, gps_data.long, timestamp)
+                else:
+                    historyData = {"location": geopoint, "timestamp": timestamp}
+                    # Generate UUIDv7 (timestamp-based)
+                    historyWrites.append((trackerId, str(uuid7()), historyData))
+
+            # Prepare location data for Firestore
+            _queue_tracker_update(
+                trackerId, {"location": geopoint, "lastUpdate": timestamp}, bucketPoint
+            )
+
+        trackerWrites = _take_due_tracker_updates(flush_all)
+        if not trackerWrites and not historyWrites:
+            return True
+
+        try:
+            try:
+                _commit_gps_writes(trackerWrites, historyWrites)
+            except NotFound:
+                # A cached tracker was deleted behind our back, reload the registry and retry once
+                logger.warning("Known tracker missing in Firestore, reloading tracker registry")
+                refresh_known_trackers()
+                _commit_gps_writes(trackerWrites, historyWrites)
+        except Exception:
+            # Retried once the tracker may be written again, rewriting what was already committed is harmless
+            _requeue_tracker_updates(trackerWrites)
+            raise
+
         return True
 
     except Exception as e:
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from app.services.positionService import update_position
+from app.services.socketioService import (
+    emit_socketio_event,
+    publish_location,
+    location_batch_frame,
+    tracker_room,
+    ALL_TRACKERS_ROOM,
+    LOCATION_BATCH_FIELDS,
+    SOCKETIO_PER_FIX_EVENTS,
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Where the standalone ingest process serves live positions to API processes.
+# The feed is unauthenticated, keep it on loopback or a private network.
+POSITION_FEED_HOST = os.getenv("POSITION_FEED_HOST", "127.0.0.1")
+POSITION_FEED_PORT = int(os.getenv("POSITION_FEED_PORT", 8766))
+# Feeds an API process subscribes to, comma separated host:port. Ingest workers in a shared MQTT
+# group each consume only some trackers, so API processes must subscribe to all of them.
+POSITION_FEED_SOURCES = [
+    source.strip()
+    for source in os.getenv("POSITION_FEED_SOURCES", f"{POSITION_FEED_HOST}:{POSITION_FEED_PORT}").split(",")
+    if source.strip()
+]
+# Newest position per tracker is sent to subscribers once per tick
+POSITION_FEED_TICK_MS = int(os.getenv("POSITION_FEED_TICK_MS", 200))
+# A subscriber that can't take a frame within this time is disconnected
+POSITION_FEED_SEND_TIMEOUT = float(os.getenv("POSITION_FEED_SEND_TIMEOUT", 2))
+# Largest frame a subscriber accepts, one frame holds one row per tracker
+POSITION_FEED_MAX_FRAME = 16 * 1024 * 1024
+
+# Publisher side, runs in the ingest process: changes since the last tick, and every newest position
+_feed_positions = {}
+_feed_latest = {}
+_feed_lock = threading.Lock()
+_feed_subscribers = []
+_feed_server = None
+_feed_threads = []
+_feed_stop = threading.Event()
+_feed_stats = {"frames": 0, "subscribers": 0, "received": 0, "connected": False, "connectedFeeds": 0}
+
+# Subscriber side, runs on the API server loop, one task per feed
+_feed_client_tasks = []
+
+
+def publish_feed_location(trackerId, latitude, longitude, timestampMs):
+    """Remember a tracker's newest position for the next feed frame, no-op unless the feed server runs"""
+    if _feed_server is None:
+        return
+    row = (trackerId, latitude, longitude, timestampMs)
+    with _feed_lock:
+        _feed_positions[trackerId] = row
+        _feed_latest[trackerId] = row
+
+
+def _encode_frame(rows):
+    return (json.dumps(location_batch_frame(rows), separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _accept_subscribers():
+    """Accept API processes connecting to the feed"""
+    while not _feed_stop.is_set():
+        try:
+            conn, address = _feed_server.accept()
+        except socket.timeout:
+            continue
+        except OSError:
+            # The listening socket was closed during shutdown
+            break
+        conn.settimeout(POSITION_FEED_SEND_TIMEOUT)
+        # A new subscriber first gets every known position, then only changes. It is registered
+        # before the snapshot is sent so no change is missed, its send lock keeps ticks behind the snapshot.
+        subscriber = (conn, threading.Lock())
+        with subscriber[1]:
+            with _feed_lock:
+                snapshot = list(_feed_latest.values())
+                _feed_subscribers.append(subscriber)
+                _feed_stats["subscribers"] = len(_feed_subscribers)
+            try:
+                if snapshot:
+                    conn.sendall(_encode_frame(snapshot))
+            except OSError as e:
+                logger.warning(f"Position feed subscriber {address[0]}:{address[1]} failed: {e}")
+                _drop_subscriber(subscriber)
+                continue
+        logger.info(f"Position feed subscriber connected from {address[0]}:{address[1]}")
+
+
+def _drop_subscriber(subscriber):
+    subscriber[0].close()
+    with _feed_lock:
+        if subscriber in _feed_subscribers:
+            _feed_subscribers.remove(subscriber)
+        _feed_stats["subscribers"] = len(_feed_subscribers)
+
+
+def _send_feed_frame():
+    """Send the positions collected since the last tick to every subscriber"""
+    with _feed_lock:
+        rows = list(_feed_positions.values())
+        _feed_positions.clear()
+        subscribers = list(_feed_subscribers)
+    if not rows or not subscribers:
+        return
+
+    frame = _encode_frame(rows)
+    for subscriber in subscribers:
+        conn, sendLock = subscriber
+        try:
+            with sendLock:
+                if conn.fileno() == -1:
+                    # Dropped while this frame waited behind its snapshot
+                    continue
+                conn.sendall(frame)
+        except OSError as e:
+            logger.warning(f"Dropping position feed subscriber: {e}")
+            _drop_subscriber(subscriber)
+    _feed_stats["frames"] += 1
+
+
+def _feed_ticker():
+    while not _feed_stop.wait(POSITION_FEED_TICK_MS / 1000):
+        _send_feed_frame()
+    # Last positions before shutting down
+    _send_feed_frame()
+
+
+def start_position_feed_server():
+    """Serve live positions to API processes, call from the standalone ingest process"""
+    global _feed_server
+    if _feed_server is not None:
+        return
+    _feed_stop.clear()
+    _feed_server = socket.create_server((POSITION_FEED_HOST, POSITION_FEED_PORT))
+    # accept() wakes up regularly to notice shutdown, closing the socket alone doesn't interrupt it
+    _feed_server.settimeout(1)
+    for target, name in ((_accept_subscribers, "position-feed-accept"), (_feed_ticker, "position-feed-tick")):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        _feed_threads.append(thread)
+    logger.info(f"Position feed listening on {POSITION_FEED_HOST}:{POSITION_FEED_PORT}")
+
+
+def stop_position_feed_server(timeout=5):
+    """Send the last frame and disconnect every subscriber"""
+    global _feed_server
+    if _feed_server is None:
+        return
+    _feed_stop.set()
+    _feed_server.close()
+    for thread in _feed_threads:
+        thread.join(timeout=timeout)
+    _feed_threads.clear()
+    with _feed_lock:
+        for conn, _ in _feed_subscribers:
+            conn.close()
+        _feed_subscribers.clear()
+        _feed_stats["subscribers"] = 0
+    _feed_server = None
+    logger.info("Position feed stopped")
+
+
+def get_position_feed_stats():
+    """Get the position feed counters of this process"""
+    return dict(_feed_stats)
+
+
+def _apply_feed_frame(frame):
+    """Feed received positions to the position store and the Socket.IO broadcaster"""
+    fields = frame.get("fields", LOCATION_BATCH_FIELDS)
+    for row in frame.get("data", []):
+        position = dict(zip(fields, row))
+        trackerId = position["trackerId"]
+        timestampMs = position.get("timestamp")
+        lastUpdate = datetime.fromtimestamp(timestampMs / 1000, timezone.utc) if timestampMs else None
+
+        if lastUpdate:
+            update_position(trackerId, position["latitude"], position["longitude"], lastUpdate)
+        publish_location(trackerId, position["latitude"], position["longitude"], timestampMs)
+
+        if SOCKETIO_PER_FIX_EVENTS:
+            websocket_data = {
+                "trackerId": trackerId,
+                "location": {
+                    "latitude": position["latitude"],
+                    "longitude": position["longitude"],
+                },
+                "timestamp": lastUpdate.isoformat().replace("+00:00", "Z") if lastUpdate else None,
+            }
+            emit_socketio_event(
+                "tracker:location_update",
+                websocket_data,
+                room=[tracker_room(trackerId), ALL_TRACKERS_ROOM],
+            )
+        _feed_stats["received"] += 1
+
+
+def _set_feed_connected(change):
+    _feed_stats["connectedFeeds"] += change
+    _feed_stats["connected"] = _feed_stats["connectedFeeds"] == len(POSITION_FEED_SOURCES)
+
+
+async def _feed_client(source):
+    """Read frames from one ingest process, reconnecting with backoff"""
+    host, _, port = source.rpartition(":")
+    delay = 1
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, int(port), limit=POSITION_FEED_MAX_FRAME)
+        except OSError as e:
+            logger.warning(f"Position feed {source} unavailable ({e}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+            continue
+
+        logger.info(f"Connected to position feed at {source}")
+        _set_feed_connected(1)
+        delay = 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    _apply_feed_frame(json.loads(line))
+                except Exception as e:
+                    logger.error(f"Invalid position feed frame from {source}: {str(e)}")
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning(f"Position feed {source} connection lost: {e}")
+        finally:
+            _set_feed_connected(-1)
+            writer.close()
+        logger.warning(f"Position feed {source} disconnected, reconnecting")
+        await asyncio.sleep(1)
+
+
+async def start_position_feed_client():
+    """Receive live positions from every standalone ingest process, call from the lifespan startup"""
+    if not _feed_client_tasks:
+        for source in POSITION_FEED_SOURCES:
+            _feed_client_tasks.append(asyncio.create_task(_feed_client(source)))
+
+
+async def stop_position_feed_client():
+    """Stop receiving live positions"""
+    for task in _feed_client_tasks:
+        task.cancel()
+    for task in _feed_client_tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _feed_client_tasks.clear()
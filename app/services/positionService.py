@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from app.config.firestore import db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# How long tracker names and tracker -> user assignments are trusted before reloading them
+TRACKER_INFO_CACHE_TTL = int(os.getenv("TRACKER_INFO_CACHE_TTL", 300))
+
+# Last known position per tracker, fed directly by the ingest pipeline
+_positions = {}
+_positions_version = 0
+_positions_lock = threading.Lock()
+
+# Cached trackerCollection fields and the user each tracker is assigned to
+_tracker_info = {}
+_tracker_users = {}
+_tracker_info_loaded_at = 0
+_tracker_info_version = 0
+_tracker_info_lock = threading.Lock()
+# Only one thread reloads the cache, requests arriving meanwhile wait for its result
+_tracker_info_refresh_lock = threading.Lock()
+
+# Versions restart with the process, so ETags are prefixed with a per-process id
+_store_id = uuid.uuid4().hex[:8]
+
+
+def _as_utc(timestamp):
+    # Trackers may send timestamps without an offset, those are UTC
+    if timestamp and timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def update_position(trackerId, latitude, longitude, lastUpdate, seeded=False):
+    """
+    Store a tracker's newest position, older fixes never replace a newer one.
+    Positions read from Firestore are stored with seeded=True, they may be older than what Firestore holds now.
+    """
+    global _positions_version
+    lastUpdate = _as_utc(lastUpdate)
+    with _positions_lock:
+        current = _positions.get(trackerId)
+        if current and lastUpdate and current["lastUpdate"]:
+            if lastUpdate < current["lastUpdate"]:
+                return False
+            # Firestore echoing a fix this process already saw doesn't make it a seed
+            if seeded and not current["seeded"] and lastUpdate == current["lastUpdate"]:
+                return False
+        _positions[trackerId] = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "lastUpdate": lastUpdate,
+            "seeded": seeded,
+        }
+        _positions_version += 1
+        return True
+
+
+def get_position(trackerId):
+    """Get a tracker's last known position (seeded if it was only read from Firestore), or None"""
+    with _positions_lock:
+        position = _positions.get(trackerId)
+        return dict(position) if position else None
+
+
+def get_all_positions():
+    """Get a copy of every last known position"""
+    with _positions_lock:
+        return {trackerId: dict(position) for trackerId, position in _positions.items()}
+
+
+def get_staleness(lastUpdate):
+    """Seconds since a position was recorded on the device"""
+    if not lastUpdate:
+        return None
+    return max(0.0, (datetime.now(timezone.utc) - _as_utc(lastUpdate)).total_seconds())
+
+
+def refresh_tracker_info():
+    """Reload tracker names and tracker -> user assignments from Firestore"""
+    global _tracker_info, _tracker_users, _tracker_info_loaded_at, _tracker_info_version
+    if not db:
+        return False
+    try:
+        trackerInfo = {}
+        for doc in (
+            db.collection("trackerCollection")
+            .select(["trackerId", "trackerName", "registrationDate", "location", "lastUpdate"])
+            .stream()
+        ):
+            trackerData = doc.to_dict()
+            # Seed positions of trackers that haven't reported since startup
+            location = trackerData.pop("location", None)
+            lastUpdate = trackerData.pop("lastUpdate", None)
+            if location and lastUpdate:
+                update_position(doc.id, location.latitude, location.longitude, lastUpdate, seeded=True)
+            trackerInfo[doc.id] = trackerData
+
+        trackerUsers = {}
+        for doc in (
+            db.collection("userCollection")
+            .select(["userId", "username", "phoneNumber", "trackerId"])
+            .stream()
+        ):
+            userData = doc.to_dict()
+            if userData.get("trackerId"):
+                trackerUsers[userData["trackerId"]] = {
+                    "userId": userData.get("userId"),
+                    "username": userData.get("username"),
+                    "phoneNumber": userData.get("phoneNumber"),
+                }
+
+        with _tracker_info_lock:
+            _tracker_info = trackerInfo
+            _tracker_users = trackerUsers
+            _tracker_info_loaded_at = time.monotonic()
+            _tracker_info_version += 1
+        return True
+    except Exception as e:
+        logger.error(f"Error loading tracker info cache: {str(e)}")
+        return False
+
+
+def invalidate_tracker_info():
+    """Force the next lookup to reload tracker info, e.g. after a tracker is (un)assigned"""
+    global _tracker_info_loaded_at
+    with _tracker_info_lock:
+        _tracker_info_loaded_at = 0
+
+
+def _tracker_info_expired():
+    return not _tracker_info_loaded_at or time.monotonic() - _tracker_info_loaded_at > TRACKER_INFO_CACHE_TTL
+
+
+def _refresh_expired_tracker_info():
+    with _tracker_info_refresh_lock:
+        # Another request may have reloaded it while this one waited
+        if _tracker_info_expired():
+            refresh_tracker_info()
+
+
+async def ensure_tracker_info():
+    """Reload the tracker info cache once its TTL has passed, call before the getters below"""
+    if _tracker_info_expired():
+        # Streams whole collections, keep it off the event loop
+        await run_in_threadpool(_refresh_expired_tracker_info)
+
+
+def get_tracker_info(trackerId):
+    """Get the cached tracker fields, or None if the tracker is unknown"""
+    with _tracker_info_lock:
+        trackerInfo = _tracker_info.get(trackerId)
+        return dict(trackerInfo) if trackerInfo is not None else None
+
+
+def get_tracker_user(trackerId):
+    """Get the cached user assigned to a tracker, or None"""
+    with _tracker_info_lock:
+        userData = _tracker_users.get(trackerId)
+        return dict(userData) if userData else None
+
+
+def get_tracker_users():
+    """Get a copy of the whole tracker -> user assignment map"""
+    with _tracker_info_lock:
+        return {trackerId: dict(userData) for trackerId, userData in _tracker_users.items()}
+
+
+def get_snapshot_etag():
+    """ETag of the fleet snapshot, it changes whenever a position or the tracker info changes"""
+    return f'"{_store_id}-{_positions_version}-{_tracker_info_version}"'
+
+
+def get_all_tracker_info():
+    """Get a copy of the cached fields of every tracker"""
+    with _tracker_info_lock:
+        return {trackerId: dict(trackerInfo) for trackerId, trackerInfo in _tracker_info.items()}
@@ -1,16 +1,276 @@
 import socketio
+import asyncio
 import logging
+import os
+import threading
+from collections import deque
+from urllib.parse import parse_qs
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from app.config.firestore import db
+from app.utils.security import get_ws_user
 
 logger = logging.getLogger(__name__)
 
+# Load environment variables
+load_dotenv()
+
+# Maximum number of events waiting for the server loop before the oldest are dropped
+SOCKETIO_EMIT_QUEUE_SIZE = int(os.getenv("SOCKETIO_EMIT_QUEUE_SIZE", 10000))
+# Latest positions are broadcast as one tracker:location_batch frame per room every tick
+SOCKETIO_BROADCAST_TICK_MS = int(os.getenv("SOCKETIO_BROADCAST_TICK_MS", 500))
+# Also emit the old per-fix tracker:location_update event, for clients that don't read batches yet
+SOCKETIO_PER_FIX_EVENTS = os.getenv("SOCKETIO_PER_FIX_EVENTS", "false").lower() == "true"
+
+# Column order of the rows in a tracker:location_batch frame
+LOCATION_BATCH_FIELDS = ["trackerId", "latitude", "longitude", "timestamp"]
+
 # Create a Socket.IO server instance
 sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
 
+# Admins can join this room to receive every tracker's updates
+ALL_TRACKERS_ROOM = "trackers:all"
+SUBSCRIBER_ROLES = ["admin", "driver"]
+
+
+def tracker_room(trackerId):
+    """Room that receives the updates of a single tracker"""
+    return f"tracker:{trackerId}"
+
+
+def _get_connect_token(environ, auth):
+    """Read the JWT from the auth payload, the token query parameter or the Authorization header"""
+    if isinstance(auth, dict) and auth.get("token"):
+        return auth["token"]
+
+    query = parse_qs(environ.get("QUERY_STRING", ""))
+    if query.get("token"):
+        return query["token"][0]
+
+    authorization = environ.get("HTTP_AUTHORIZATION", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return None
+
+
 # Socket.IO event handlers
 @sio.event
-async def connect(sid, environ):
-    logger.info(f"Client connected: {sid}")
+async def connect(sid, environ, auth=None):
+    token = _get_connect_token(environ, auth)
+    if not token:
+        raise socketio.exceptions.ConnectionRefusedError("Token tidak ditemukan")
+
+    user = await get_ws_user(token)
+    if not isinstance(user, dict) or user.get("role") not in SUBSCRIBER_ROLES:
+        raise socketio.exceptions.ConnectionRefusedError("Token tidak valid")
+
+    await sio.save_session(sid, {"user": user})
+    logger.info(f"Client connected: {sid} ({user.get('username')})")
 
 @sio.event
 async def disconnect(sid):
-    logger.info(f"Client disconnected: {sid}")
\ No newline at end of file
+    logger.info(f"Client disconnected: {sid}")
+
+
+def _get_subscription_trackers(data):
+    """Tracker ids from a subscribe payload: {"trackerId": id} or {"trackerIds": [ids]}"""
+    if not isinstance(data, dict):
+        return []
+    trackerIds = data.get("trackerIds") or []
+    if data.get("trackerId"):
+        trackerIds = [data["trackerId"], *trackerIds]
+    return [trackerId for trackerId in trackerIds if isinstance(trackerId, str) and trackerId]
+
+
+def _get_assigned_tracker(userId):
+    """Tracker assigned to a user in userCollection, or None"""
+    if not db or not userId:
+        return None
+    userDoc = db.collection("userCollection").document(userId).get()
+    return userDoc.to_dict().get("trackerId") if userDoc.exists else None
+
+
+@sio.on("tracker:subscribe")
+async def subscribe_tracker(sid, data):
+    """Join tracker rooms, {"all": true} joins every tracker (admin only), drivers only their own tracker"""
+    session = await sio.get_session(sid)
+    user = session.get("user", {})
+
+    if isinstance(data, dict) and data.get("all"):
+        if user.get("role") != "admin":
+            return {"status": "fail", "message": "Anda tidak memiliki akses untuk melihat semua tracker."}
+        await sio.enter_room(sid, ALL_TRACKERS_ROOM)
+        return {"status": "success", "message": "Berhasil berlangganan semua tracker"}
+
+    trackerIds = _get_subscription_trackers(data)
+    if not trackerIds:
+        return {"status": "fail", "message": "trackerId wajib diisi"}
+
+    if user.get("role") != "admin":
+        # Checked on every subscribe so a reassigned tracker is no longer followed by its old driver
+        try:
+            assignedTracker = await run_in_threadpool(_get_assigned_tracker, user.get("userId"))
+        except Exception as e:
+            logger.error(f"Error checking the tracker of {user.get('username')}: {str(e)}")
+            assignedTracker = None
+        deniedIds = [trackerId for trackerId in trackerIds if trackerId != assignedTracker]
+        if deniedIds:
+            error = {
+                "status": "fail",
+                "message": "Anda tidak memiliki akses untuk melihat data tracker.",
+                "data": deniedIds,
+            }
+            await sio.emit("tracker:error", error, to=sid)
+            return error
+
+    for trackerId in trackerIds:
+        await sio.enter_room(sid, tracker_room(trackerId))
+    return {"status": "success", "message": "Berhasil berlangganan tracker", "data": trackerIds}
+
+
+@sio.on("tracker:unsubscribe")
+async def unsubscribe_tracker(sid, data):
+    """Leave tracker rooms, {"all": true} leaves the all-trackers room"""
+    if isinstance(data, dict) and data.get("all"):
+        await sio.leave_room(sid, ALL_TRACKERS_ROOM)
+        return {"status": "success", "message": "Berhasil berhenti berlangganan semua tracker"}
+
+    trackerIds = _get_subscription_trackers(data)
+    for trackerId in trackerIds:
+        await sio.leave_room(sid, tracker_room(trackerId))
+    return {"status": "success", "message": "Berhasil berhenti berlangganan tracker", "data": trackerIds}
+
+# Events emitted from other threads (MQTT/ingest) are queued here and emitted by one task on the server loop
+_server_loop = None
+_emit_task = None
+_emit_wakeup = None
+_wakeup_scheduled = False
+_pending_emits = deque(maxlen=SOCKETIO_EMIT_QUEUE_SIZE)
+_emit_stats = {"emitted": 0, "dropped": 0, "batchFrames": 0}
+
+# Newest position per tracker since the last broadcast tick
+_latest_positions = {}
+_positions_lock = threading.Lock()
+_broadcast_task = None
+
+
+async def _emit_drainer():
+    """Emit everything queued by other threads, one batch per wakeup"""
+    global _wakeup_scheduled
+    while True:
+        await _emit_wakeup.wait()
+        _emit_wakeup.clear()
+        # Clear the flag before draining so a concurrent producer schedules a new wakeup
+        _wakeup_scheduled = False
+        await _flush_pending_emits()
+
+
+async def _flush_pending_emits():
+    while _pending_emits:
+        event, data, room = _pending_emits.popleft()
+        try:
+            await sio.emit(event, data, room=room)
+            _emit_stats["emitted"] += 1
+        except Exception as e:
+            logger.error(f"Error emitting Socket.IO event: {str(e)}")
+
+
+def publish_location(trackerId, latitude, longitude, timestampMs):
+    """Record a tracker's newest position for the next broadcast tick, safe from any thread"""
+    with _positions_lock:
+        _latest_positions[trackerId] = [trackerId, latitude, longitude, timestampMs]
+
+
+def location_batch_frame(rows):
+    """Compact frame: field names once, then one array per tracker"""
+    return {"fields": LOCATION_BATCH_FIELDS, "data": rows}
+
+
+async def _broadcast_latest_positions():
+    """Emit one frame per tracker room and one frame with every update to the all-trackers room"""
+    global _latest_positions
+    with _positions_lock:
+        positions, _latest_positions = _latest_positions, {}
+    if not positions:
+        return
+
+    try:
+        # Admins in the all-trackers room already get every row in the combined frame
+        allRoomSids = [sid for sid, _ in sio.manager.get_participants("/", ALL_TRACKERS_ROOM)]
+        for trackerId, row in positions.items():
+            await sio.emit(
+                "tracker:location_batch",
+                location_batch_frame([row]),
+                room=tracker_room(trackerId),
+                skip_sid=allRoomSids or None,
+            )
+        await sio.emit(
+            "tracker:location_batch",
+            location_batch_frame(list(positions.values())),
+            room=ALL_TRACKERS_ROOM,
+        )
+        _emit_stats["batchFrames"] += len(positions) + 1
+    except Exception as e:
+        logger.error(f"Error broadcasting location batch: {str(e)}")
+
+
+async def _broadcast_ticker():
+    """Broadcast the latest positions every tick, bounding outbound frames regardless of fleet size"""
+    while True:
+        await asyncio.sleep(SOCKETIO_BROADCAST_TICK_MS / 1000)
+        await _broadcast_latest_positions()
+
+
+async def start_socketio_bridge():
+    """Capture the running server loop and start the emit tasks, call from the lifespan startup"""
+    global _server_loop, _emit_task, _emit_wakeup, _broadcast_task
+    _server_loop = asyncio.get_running_loop()
+    _emit_wakeup = asyncio.Event()
+    _emit_task = asyncio.create_task(_emit_drainer())
+    _broadcast_task = asyncio.create_task(_broadcast_ticker())
+    logger.info("Socket.IO bridge started")
+
+
+async def stop_socketio_bridge():
+    """Stop the emit tasks after emitting whatever is still queued"""
+    global _server_loop, _emit_task, _broadcast_task
+    for task in (_emit_task, _broadcast_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    if _emit_task:
+        await _flush_pending_emits()
+        await _broadcast_latest_positions()
+    _server_loop = None
+    _emit_task = None
+    _broadcast_task = None
+
+
+def get_socketio_stats():
+    """Get the Socket.IO bridge counters"""
+    return {**_emit_stats, "pending": len(_pending_emits)}
+
+
+def emit_socketio_event(event, data, room=None):
+    """Queue a Socket.IO emit from any thread, it is sent from the server loop"""
+    global _wakeup_scheduled
+    if _server_loop is None:
+        logger.debug("Socket.IO bridge not started, can't emit event")
+        return False
+
+    # deque append is thread-safe, the oldest event is dropped when it is full
+    if len(_pending_emits) >= SOCKETIO_EMIT_QUEUE_SIZE:
+        _emit_stats["dropped"] += 1
+    _pending_emits.append((event, data, room))
+    if not _wakeup_scheduled:
+        _wakeup_scheduled = True
+        try:
+            _server_loop.call_soon_threadsafe(_emit_wakeup.set)
+        except RuntimeError:
+            # The loop is already closed during shutdown
+            _wakeup_scheduled = False
+            return False
+    return True
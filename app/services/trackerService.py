@@ -1,12 +1,59 @@
 from app.config.firestore import db
 from app.utils.time import convert_utc_to_wib, get_wib_day_range
+from app.services.mqttService import HISTORY_STORAGE_MODE, history_bucket_id
+from app.services.positionService import (
+    get_position,
+    get_all_positions,
+    update_position,
+    get_staleness,
+    ensure_tracker_info,
+    get_tracker_info,
+    get_all_tracker_info,
+    get_tracker_user,
+    get_tracker_users,
+    get_snapshot_etag,
+)
 from fastapi import HTTPException
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from google.cloud.firestore import FieldFilter
 import logging
 logger = logging.getLogger(__name__)
 
 
+def getBucketedHistory(trackerRef, start, end):
+    """Read history points between start and end from the hourly bucket documents"""
+    # One bucket per UTC hour in the range, fetched in a single batched read
+    bucketRefs = []
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour <= end:
+        bucketRefs.append(trackerRef.collection("locationBuckets").document(history_bucket_id(hour)))
+        hour += timedelta(hours=1)
+
+    startMs = int(start.timestamp() * 1000)
+    endMs = int(end.timestamp() * 1000)
+
+    points = []
+    for bucketDoc in db.get_all(bucketRefs):
+        if not bucketDoc.exists:
+            continue
+        for point in bucketDoc.to_dict().get("points", []):
+            if startMs <= point["t"] <= endMs:
+                points.append(point)
+
+    # Newest first, like the per-document query
+    points.sort(key=lambda point: point["t"], reverse=True)
+
+    historyLocations = []
+    for point in points:
+        timestamp = datetime.fromtimestamp(point["t"] / 1000, timezone.utc)
+        historyLocations.append({
+            "latitude": point["lat"],
+            "longitude": point["lon"],
+            "timestamp": convert_utc_to_wib(timestamp).isoformat(),
+        })
+    return historyLocations
+
+
 async def getTrackerLocation(trackerId, currentUser):
     """Get the latest location of a specific tracker"""
     try:
@@ -20,6 +67,37 @@ async def getTrackerLocation(trackerId, currentUser):
                 }
             )
         
+        # Serve from the live position store when the tracker has reported since startup,
+        # positions seeded from Firestore may be older than Firestore by now
+        position = get_position(trackerId)
+        if position and position["seeded"]:
+            position = None
+        if position:
+            await ensure_tracker_info()
+        trackerInfo = get_tracker_info(trackerId) if position else None
+        if position and trackerInfo is not None:
+            data = {
+                "trackerId": trackerInfo.get("trackerId"),
+                "trackerName": trackerInfo.get("trackerName"),
+                "location": {
+                    "latitude": position["latitude"],
+                    "longitude": position["longitude"],
+                },
+                "lastUpdate": position["lastUpdate"],
+                "registrationDate": trackerInfo.get("registrationDate"),
+                "staleness": get_staleness(position["lastUpdate"]),
+                "source": "memory",
+            }
+            userData = get_tracker_user(trackerId)
+            if userData:
+                data.update(userData)
+
+            return {
+                "status": "success",
+                "message": "Berhasil mendapatkan data lokasi tracker",
+                "data": data
+            }
+
         # Get tracker from database
         trackerDoc = (
             db.collection("trackerCollection")
@@ -43,7 +121,16 @@ async def getTrackerLocation(trackerId, currentUser):
             "location": trackerData.get("location"),
             "lastUpdate": trackerData.get("lastUpdate"),
             "registrationDate": trackerData.get("registrationDate"),        
+            "staleness": get_staleness(trackerData.get("lastUpdate")),
+            "source": "firestore",
         }
+
+        # Seed the position store for the fleet snapshot until the tracker reports to this process
+        location = trackerData.get("location")
+        if location and trackerData.get("lastUpdate"):
+            update_position(
+                trackerId, location.latitude, location.longitude, trackerData.get("lastUpdate"), seeded=True
+            )
         
         # Get user who uses the tracker
         userDoc = (
@@ -110,36 +197,40 @@ async def getTrackerDailyHistory(trackerId, currentUser):
         
         trackerData = trackerDoc.to_dict()
         
-        # Get location history from subcollection for today
-        historyQuery = (
-            trackerRef.collection("locationHistory")
-            .where(filter=FieldFilter("timestamp", ">=", todayStart))
-            .where(filter=FieldFilter("timestamp", "<=", todayEnd))
-            .order_by("timestamp", direction="DESCENDING")
-        )
+        if HISTORY_STORAGE_MODE == "buckets":
+            # ~24 bucket documents per day instead of one document per point
+            historyLocations = getBucketedHistory(trackerRef, todayStart, todayEnd)
+        else:
+            # Get location history from subcollection for today
+            historyQuery = (
+                trackerRef.collection("locationHistory")
+                .where(filter=FieldFilter("timestamp", ">=", todayStart))
+                .where(filter=FieldFilter("timestamp", "<=", todayEnd))
+                .order_by("timestamp", direction="DESCENDING")
+            )
+        
+            # Execute query
+            historyDocs = historyQuery.stream()
         
-        # Execute query
-        historyDocs = historyQuery.stream()
-        
-        # Process results
-        historyLocations = []
-        for doc in historyDocs:                                                                                                                                                                                                                                                                                                                                                                                                                             
-            locationData = doc.to_dict()
-            historyData = {}
-            # # Format GeoPoint for JSON response
-            # if "location" in locationData and locationData["location"]:
-            #     locationData["location"] = {
-            #         "latitude": locationData["location"].latitude,
-            #         "longitude": locationData["location"].longitude
-            #     }
-            historyData["latitude"] = locationData["location"].latitude
-            historyData["longitude"] = locationData["location"].longitude
-
-            # Convert timestamp to WIB
-            if "timestamp" in locationData and locationData["timestamp"]:
-                historyData["timestamp"] = convert_utc_to_wib(locationData["timestamp"]).isoformat()
+            # Process results
+            historyLocations = []
+            for doc in historyDocs:                                                                                                                                                                                                                                                                                                                                                                                                                             
+                locationData = doc.to_dict()
+                historyData = {}
+                # # Format GeoPoint for JSON response
+                # if "location" in locationData and locationData["location"]:
+                #     locationData["location"] = {
+                #         "latitude": locationData["location"].latitude,
+                #         "longitude": locationData["location"].longitude
+                #     }
+                historyData["latitude"] = locationData["location"].latitude
+                historyData["longitude"] = locationData["location"].longitude
+
+                # Convert timestamp to WIB
+                if "timestamp" in locationData and locationData["timestamp"]:
+                    historyData["timestamp"] = convert_utc_to_wib(locationData["timestamp"]).isoformat()
             
-            historyLocations.append(historyData)
+                historyLocations.append(historyData)
         
         data = {
             "trackerId": trackerId,
@@ -167,6 +258,79 @@ async def getTrackerDailyHistory(trackerId, currentUser):
             }
         )
 
+# Column order of the fleet snapshot payload
+SNAPSHOT_FIELDS = ["trackerId", "trackerName", "latitude", "longitude", "timestamp", "userId", "username"]
+
+
+def _etag_matches(ifNoneMatch, etag):
+    """Check an If-None-Match header against an ETag, ignoring weak validator prefixes"""
+    if not ifNoneMatch:
+        return False
+    for candidate in ifNoneMatch.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def getTrackerSnapshot(currentUser, ifNoneMatch=None):
+    """Get the latest position of every tracker as columns, returns (etag, result or None if unchanged)"""
+    try:
+        # Check if user is admin
+        if currentUser["role"] not in ["admin"]:
+            raise HTTPException(
+                status_code=403,
+                detail={
+                    "status": "fail",
+                    "message": "Anda tidak memiliki akses untuk melihat semua data tracker.",
+                }
+            )
+
+        await ensure_tracker_info()
+        etag = get_snapshot_etag()
+        if _etag_matches(ifNoneMatch, etag):
+            return etag, None
+
+        positions = get_all_positions()
+        trackerInfo = get_all_tracker_info()
+        trackerUsers = get_tracker_users()
+
+        columns = {field: [] for field in SNAPSHOT_FIELDS}
+        for trackerId in sorted(trackerInfo.keys() | positions.keys()):
+            position = positions.get(trackerId, {})
+            userData = trackerUsers.get(trackerId, {})
+            lastUpdate = position.get("lastUpdate")
+            columns["trackerId"].append(trackerId)
+            columns["trackerName"].append(trackerInfo.get(trackerId, {}).get("trackerName"))
+            columns["latitude"].append(position.get("latitude"))
+            columns["longitude"].append(position.get("longitude"))
+            # Epoch milliseconds, like the Socket.IO location batch frames
+            columns["timestamp"].append(int(lastUpdate.timestamp() * 1000) if lastUpdate else None)
+            columns["userId"].append(userData.get("userId"))
+            columns["username"].append(userData.get("username"))
+
+        return etag, {
+            "status": "success",
+            "message": "Berhasil mendapatkan snapshot lokasi semua tracker",
+            "data": {
+                "count": len(columns["trackerId"]),
+                "generatedAt": int(datetime.now(timezone.utc).timestamp() * 1000),
+                "fields": SNAPSHOT_FIELDS,
+                "columns": columns,
+            }
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "fail",
+                "message": f"Terjadi kesalahan: {str(e)}",
+            }
+        )
+
 async def getAllTracker(currentUser):
     """Get all trackers"""
     try:
@@ -0,0 +1,59 @@
+import logging
+import struct
+from datetime import datetime, timezone
+from pydantic import TypeAdapter
+from app.models.mqttModel import GPSRecord
+
+logger = logging.getLogger(__name__)
+
+# Built once at import, pydantic-core then parses and validates JSON bytes in a single pass
+GPS_RECORD_VALIDATOR = TypeAdapter(GPSRecord)
+
+# Plaintext of a v1 binary payload: 6-byte MAC id, lat/lon in 1e-7 degrees,
+# device time in epoch ms, satellites and iteration, little-endian (27 bytes)
+BINARY_RECORD_V1 = struct.Struct("<6siiQBI")
+COORDINATE_SCALE = 10_000_000
+
+
+def decode_gps_record(decrypted_bytes):
+    """
+    Decodes decrypted tracker bytes into a GPSRecord.
+    Args:
+        decrypted_bytes (bytes): The decrypted UTF-8 JSON payload.
+    Returns:
+        GPSRecord: The validated record, raises ValidationError if the payload is invalid.
+    """
+    return GPS_RECORD_VALIDATOR.validate_json(decrypted_bytes)
+
+
+def decode_binary_gps_record(decrypted_bytes):
+    """
+    Decodes the decrypted plaintext of a v1 binary payload into a GPSRecord.
+    Args:
+        decrypted_bytes (bytes): The decrypted fixed-layout record.
+    Returns:
+        GPSRecord: The record, raises struct.error if the payload has the wrong size.
+    """
+    mac, lat, lon, timestamp_ms, satellites, iteration = BINARY_RECORD_V1.unpack(decrypted_bytes)
+    timestamp = datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc)
+    return GPSRecord(
+        id=":".join(f"{byte:02X}" for byte in mac),
+        lat=lat / COORDINATE_SCALE,
+        long=lon / COORDINATE_SCALE,
+        # Same ISO format the JSON firmware sends, so both formats look alike downstream
+        timestamp=timestamp.isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+        satellites=satellites,
+        iteration=iteration,
+    )
+
+
+def encode_binary_gps_record(trackerId, lat, lon, timestamp_ms, satellites=0, iteration=0):
+    """Build the plaintext of a v1 binary payload, the reference for firmware and simulators"""
+    return BINARY_RECORD_V1.pack(
+        bytes.fromhex(trackerId.replace(":", "")),
+        round(lat * COORDINATE_SCALE),
+        round(lon * COORDINATE_SCALE),
+        timestamp_ms,
+        satellites,
+        iteration,
+    )
@@ -7,143 +7,338 @@ import os
 
 logger = logging.getLogger(__name__)
 
+try:
+    # pycryptodome ships a C implementation of the original (64-bit nonce) ChaCha20
+    from Crypto.Cipher import ChaCha20
+except ImportError:
+    ChaCha20 = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 MQTT_ENCRYPT_KEY = os.getenv("MQTT_ENCRYPT_KEY")
 HEX_KEY = bytes.fromhex(MQTT_ENCRYPT_KEY)
 
-def decrypt_message(encrypted_hex_message: str, key=HEX_KEY):
-    """
-    Decrypts a hex-encoded ChaCha20 encrypted message.
-    Args:
-        encrypted_hex_message (str): The hex-encoded encrypted message.
-        key (bytes): The 256-bit key for decryption. Default is a predefined key.
-    Returns:
-        dict: The decrypted JSON payload.
-    Raises:
-        UnicodeDecodeError: If the decrypted bytes cannot be decoded as UTF-8.
-        json.JSONDecodeError: If the decrypted message is not valid JSON.
-    """
+# Which keystream implementation to use: auto, native, numpy or python
+MQTT_DECRYPT_BACKEND = os.getenv("MQTT_DECRYPT_BACKEND", "auto").lower()
+
+# Raw binary payloads start with their format version, hex payloads always start with an ASCII digit/letter
+BINARY_PAYLOAD_V1 = b"\x01"
+
+# Constants for ChaCha20
+CHACHA20_CONSTANTS = (0x61707865, 0x3320646E, 0x79622D32, 0x6B206574)
+COUNTER_LIMIT = 1 << 64
+
+
+def quarter_round(state, a, b, c, d):
+    """ChaCha20 quarter round function"""
+    # a += b; d ^= a; d <<<= 16
+    state[a] = (state[a] + state[b]) & 0xFFFFFFFF
+    state[d] ^= state[a]
+    state[d] = ((state[d] << 16) | (state[d] >> 16)) & 0xFFFFFFFF
+
+    # c += d; b ^= c; b <<<= 12
+    state[c] = (state[c] + state[d]) & 0xFFFFFFFF
+    state[b] ^= state[c]
+    state[b] = ((state[b] << 12) | (state[b] >> 20)) & 0xFFFFFFFF
+
+    # a += b; d ^= a; d <<<= 8
+    state[a] = (state[a] + state[b]) & 0xFFFFFFFF
+    state[d] ^= state[a]
+    state[d] = ((state[d] << 8) | (state[d] >> 24)) & 0xFFFFFFFF
+
+    # c += d; b ^= c; b <<<= 7
+    state[c] = (state[c] + state[d]) & 0xFFFFFFFF
+    state[b] ^= state[c]
+    state[b] = ((state[b] << 7) | (state[b] >> 25)) & 0xFFFFFFFF
+
+    return state
+
+
+def chacha20_block(key, counter_value, nonce):
+    """Generate a ChaCha20 block"""
+    # Create initial state
+    state = list(CHACHA20_CONSTANTS)  # Copy the constants
+
+    # Add key words (8 for 256-bit key)
+    state.extend(struct.unpack("<8I", key[:32]))
+
+    # Add counter and nonce
+    state.append(counter_value & 0xFFFFFFFF)  # Lower 32 bits of counter
+    state.append((counter_value >> 32) & 0xFFFFFFFF)  # Upper 32 bits of counter
+    state.append(struct.unpack("<I", nonce[:4])[0])
+    state.append(struct.unpack("<I", nonce[4:8])[0])
+
+    # Copy initial state
+    working_state = state[:]
+
+    # ChaCha20 rounds (20 rounds = 10 iterations of double round)
+    for _ in range(10):
+        # Column round
+        quarter_round(working_state, 0, 4, 8, 12)
+        quarter_round(working_state, 1, 5, 9, 13)
+        quarter_round(working_state, 2, 6, 10, 14)
+        quarter_round(working_state, 3, 7, 11, 15)
+
+        # Diagonal round
+        quarter_round(working_state, 0, 5, 10, 15)
+        quarter_round(working_state, 1, 6, 11, 12)
+        quarter_round(working_state, 2, 7, 8, 13)
+        quarter_round(working_state, 3, 4, 9, 14)
+
+    # Add working state to initial state and convert to bytes
+    return struct.pack(
+        "<16I", *((state[i] + working_state[i]) & 0xFFFFFFFF for i in range(16))
+    )
+
+
+def _keystream_python(key, jobs):
+    """Reference keystream, one (counter, nonce, length) job at a time"""
+    keystreams = []
+    for counter_value, nonce, length in jobs:
+        # Generate keystream blocks for each 64-byte chunk of ciphertext
+        blocks_needed = (length + 63) // 64  # Ceiling division
+        keystream = b"".join(
+            chacha20_block(key, counter_value + block, nonce)
+            for block in range(blocks_needed)
+        )
+        keystreams.append(keystream[:length])
+    return keystreams
+
+
+def _keystream_numpy(key, jobs):
+    """Compute the keystream blocks of every job at once with uint32 array ops"""
+    counters = []
+    nonces = []
+    for counter_value, nonce, length in jobs:
+        blocks_needed = (length + 63) // 64
+        counters.append(
+            np.arange(blocks_needed, dtype=np.uint64) + np.uint64(counter_value)
+        )
+        nonces.append(
+            np.tile(np.frombuffer(nonce[:8], dtype="<u4"), (blocks_needed, 1))
+        )
+
+    counters = np.concatenate(counters)
+    nonces = np.concatenate(nonces)
+    total_blocks = len(counters)
+
+    # One row per state word, one column per keystream block
+    state = np.empty((16, total_blocks), dtype=np.uint32)
+    state[0:4] = np.array(CHACHA20_CONSTANTS, dtype=np.uint32)[:, None]
+    state[4:12] = np.frombuffer(key[:32], dtype="<u4")[:, None]
+    state[12] = (counters & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    state[13] = (counters >> np.uint64(32)).astype(np.uint32)
+    state[14:16] = nonces.T
+
+    x = [row.copy() for row in state]
+
+    def qr(a, b, c, d):
+        x[a] += x[b]
+        x[d] ^= x[a]
+        x[d] = (x[d] << 16) | (x[d] >> 16)
+        x[c] += x[d]
+        x[b] ^= x[c]
+        x[b] = (x[b] << 12) | (x[b] >> 20)
+        x[a] += x[b]
+        x[d] ^= x[a]
+        x[d] = (x[d] << 8) | (x[d] >> 24)
+        x[c] += x[d]
+        x[b] ^= x[c]
+        x[b] = (x[b] << 7) | (x[b] >> 25)
+
+    for _ in range(10):
+        qr(0, 4, 8, 12)
+        qr(1, 5, 9, 13)
+        qr(2, 6, 10, 14)
+        qr(3, 7, 11, 15)
+        qr(0, 5, 10, 15)
+        qr(1, 6, 11, 12)
+        qr(2, 7, 8, 13)
+        qr(3, 4, 9, 14)
+
+    # Block-major little-endian bytes, 64 per block
+    keystream = (np.stack(x) + state).T.astype("<u4").tobytes()
+
+    keystreams = []
+    offset = 0
+    for _, _, length in jobs:
+        keystreams.append(keystream[offset : offset + length])
+        offset += ((length + 63) // 64) * 64
+    return keystreams
+
+
+def _keystream_native(key, jobs):
+    """Keystream from the C ChaCha20 implementation"""
+    keystreams = []
+    for counter_value, nonce, length in jobs:
+        blocks_needed = (length + 63) // 64
+        if counter_value + blocks_needed >= COUNTER_LIMIT:
+            # The native cipher refuses the last counter value and never wraps, the reference one does
+            keystreams.extend(_keystream_python(key, [(counter_value, nonce, length)]))
+            continue
+        cipher = ChaCha20.new(key=key, nonce=nonce[:8])
+        cipher.seek(counter_value * 64)
+        keystreams.append(cipher.encrypt(bytes(length)))
+    return keystreams
+
 
-    def quarter_round(state, a, b, c, d):
-        """ChaCha20 quarter round function"""
-        # a += b; d ^= a; d <<<= 16
-        state[a] = (state[a] + state[b]) & 0xFFFFFFFF
-        state[d] ^= state[a]
-        state[d] = ((state[d] << 16) | (state[d] >> 16)) & 0xFFFFFFFF
-
-        # c += d; b ^= c; b <<<= 12
-        state[c] = (state[c] + state[d]) & 0xFFFFFFFF
-        state[b] ^= state[c]
-        state[b] = ((state[b] << 12) | (state[b] >> 20)) & 0xFFFFFFFF
-
-        # a += b; d ^= a; d <<<= 8
-        state[a] = (state[a] + state[b]) & 0xFFFFFFFF
-        state[d] ^= state[a]
-        state[d] = ((state[d] << 8) | (state[d] >> 24)) & 0xFFFFFFFF
-
-        # c += d; b ^= c; b <<<= 7
-        state[c] = (state[c] + state[d]) & 0xFFFFFFFF
-        state[b] ^= state[c]
-        state[b] = ((state[b] << 7) | (state[b] >> 25)) & 0xFFFFFFFF
-
-        return state
-
-    def chacha20_block(key, counter_value, nonce):
-        """Generate a ChaCha20 block"""
-        # Constants for ChaCha20
-        CONSTANTS = [0x61707865, 0x3320646E, 0x79622D32, 0x6B206574]
-
-        # Create initial state
-        state = CONSTANTS[:]  # Copy the constants
-
-        # Add key words (8 for 256-bit key)
-        for i in range(8):
-            state.append(struct.unpack("<I", key[i * 4 : i * 4 + 4])[0])
-
-        # Add counter and nonce
-        state.append(counter_value & 0xFFFFFFFF)  # Lower 32 bits of counter
-        state.append((counter_value >> 32) & 0xFFFFFFFF)  # Upper 32 bits of counter
-        state.append(struct.unpack("<I", nonce[:4])[0])
-        state.append(struct.unpack("<I", nonce[4:8])[0])
-
-        # Copy initial state
-        working_state = state[:]
-
-        # ChaCha20 rounds (20 rounds = 10 iterations of double round)
-        for _ in range(10):
-            # Column round
-            working_state = quarter_round(working_state, 0, 4, 8, 12)
-            working_state = quarter_round(working_state, 1, 5, 9, 13)
-            working_state = quarter_round(working_state, 2, 6, 10, 14)
-            working_state = quarter_round(working_state, 3, 7, 11, 15)
-
-            # Diagonal round
-            working_state = quarter_round(working_state, 0, 5, 10, 15)
-            working_state = quarter_round(working_state, 1, 6, 11, 12)
-            working_state = quarter_round(working_state, 2, 7, 8, 13)
-            working_state = quarter_round(working_state, 3, 4, 9, 14)
-
-        # Add working state to initial state
-        for i in range(16):
-            state[i] = (state[i] + working_state[i]) & 0xFFFFFFFF
-
-        # Convert state to bytes
-        result = bytearray(64)
-        for i in range(16):
-            struct.pack_into("<I", result, i * 4, state[i])
-
-        return bytes(result)
+KEYSTREAM_BACKENDS = {"python": _keystream_python}
+if np is not None:
+    KEYSTREAM_BACKENDS["numpy"] = _keystream_numpy
+if ChaCha20 is not None:
+    KEYSTREAM_BACKENDS["native"] = _keystream_native
 
+
+def _verify_backend(name):
+    """Check a backend against the reference implementation bit for bit"""
+    key = bytes(range(32))
+    jobs = [
+        (0, b"\x00" * 8, 1),
+        (7, bytes(range(8, 16)), 130),
+        ((1 << 32) - 1, bytes(range(16, 24)), 200),
+    ]
     try:
+        return KEYSTREAM_BACKENDS[name](key, jobs) == _keystream_python(key, jobs)
+    except Exception as e:
+        logger.error(f"Decrypt backend '{name}' failed self-test: {e}")
+        return False
+
+
+def _select_backend():
+    """Pick the configured keystream backend, falling back to the reference one"""
+    if MQTT_DECRYPT_BACKEND == "auto":
+        candidates = ["native", "numpy"]
+    else:
+        candidates = [MQTT_DECRYPT_BACKEND]
+
+    for name in candidates:
+        if name == "python":
+            break
+        if name not in KEYSTREAM_BACKENDS:
+            logger.warning(f"Decrypt backend '{name}' is not available")
+            continue
+        if _verify_backend(name):
+            logger.info(f"Using '{name}' decrypt backend")
+            return name, KEYSTREAM_BACKENDS[name]
+        logger.error(f"Decrypt backend '{name}' does not match the reference output")
+
+    logger.info("Using 'python' decrypt backend")
+    return "python", _keystream_python
+
+
+DECRYPT_BACKEND, _keystream = _select_backend()
+
+
+def is_binary_payload(payload):
+    """Check whether an MQTT payload uses the raw binary format instead of hex"""
+    return isinstance(payload, (bytes, bytearray)) and payload[:1] == BINARY_PAYLOAD_V1
+
+
+def _split_message(encrypted_hex_message):
+    """Split a hex-encoded or raw binary message into (counter, iv, ciphertext)"""
+    if is_binary_payload(encrypted_hex_message):
+        # Version byte, then the same iv/counter/ciphertext layout without the hex encoding
+        encrypted_message = bytes(encrypted_hex_message[1:])
+    else:
         encrypted_message = binascii.unhexlify(encrypted_hex_message)
+    if len(encrypted_message) < 16:
+        raise ValueError("Encrypted message is shorter than its IV and counter")
 
-        iv = encrypted_message[:8]
-        counter_bytes = encrypted_message[8:16]
-        ciphertext = encrypted_message[16:]
+    iv = encrypted_message[:8]
+    counter_bytes = encrypted_message[8:16]
+    ciphertext = encrypted_message[16:]
 
-        # logger.debug(f"IV: {iv.hex()}")
-        # logger.debug(f"Counter: {counter_bytes.hex()}")
-        # logger.debug(f"Ciphertext: {ciphertext.hex()}")
-        # logger.debug(f"Ciphertext length: {len(ciphertext)} bytes")
+    # Get the starting counter value as a 64-bit integer
+    counter_value = int.from_bytes(counter_bytes, byteorder="little")
+    return counter_value, iv, ciphertext
 
-        # Get the starting counter value as a 64-bit integer
-        counter_value = int.from_bytes(counter_bytes, byteorder="little")
 
-        # Create an empty buffer for the keystream
-        keystream = bytearray()
+def _parse_plaintext(decrypted_bytes):
+    """Decode decrypted bytes as UTF-8 JSON"""
+    try:
+        # Try to decode as UTF-8
+        decrypted_message = decrypted_bytes.decode("utf-8")
+        logger.debug(f"Decrypted message: {decrypted_message}")
 
-        # Generate keystream blocks for each 64-byte chunk of ciphertext
-        blocks_needed = (len(ciphertext) + 63) // 64  # Ceiling division
+        # Try to parse as JSON
+        return json.loads(decrypted_message)
+    except UnicodeDecodeError as e:
+        # If UTF-8 decoding fails, log the error and hex dump for debugging
+        logger.error(f"UTF-8 decode error: {e}")
+        logger.debug(f"Decrypted hex: {decrypted_bytes.hex()}")
+        logger.debug(f"First 100 bytes: {decrypted_bytes[:100].hex()}")
+        raise
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error: {e}")
+        logger.debug(f"Decrypted text: {decrypted_message}")
+        raise
 
-        for block in range(blocks_needed):
-            # Generate keystream block with current counter value
-            keystream_block = chacha20_block(key, counter_value + block, iv)
-            keystream.extend(keystream_block)
 
-        # Trim keystream to match ciphertext length
-        keystream = keystream[: len(ciphertext)]
+def decrypt_message(encrypted_hex_message: str, key=HEX_KEY):
+    """
+    Decrypts a hex-encoded ChaCha20 encrypted message.
+    Args:
+        encrypted_hex_message (str): The hex-encoded encrypted message.
+        key (bytes): The 256-bit key for decryption. Default is a predefined key.
+    Returns:
+        dict: The decrypted JSON payload, or None if it could not be decrypted.
+    """
+    return decrypt_messages([encrypted_hex_message], key)[0]
 
-        # XOR keystream with ciphertext to get plaintext
-        decrypted_bytes = strxor(ciphertext, keystream)
 
+def decrypt_payloads(encrypted_hex_messages, key=HEX_KEY):
+    """
+    Decrypts many ChaCha20 encrypted messages with one keystream call.
+    Args:
+        encrypted_hex_messages (list[str | bytes]): Hex-encoded or raw binary (version byte first) messages.
+        key (bytes): The 256-bit key for decryption. Default is a predefined key.
+    Returns:
+        list: The decrypted bytes, None for every message that failed.
+    """
+    results = [None] * len(encrypted_hex_messages)
+    indexes = []
+    parts = []
+    for index, encrypted_hex_message in enumerate(encrypted_hex_messages):
         try:
-            # Try to decode as UTF-8
-            decrypted_message = decrypted_bytes.decode("utf-8")
-            logger.debug(f"Decrypted message: {decrypted_message}")
-
-            # Try to parse as JSON
-            decrypted_payload = json.loads(decrypted_message)
-            return decrypted_payload
-        except UnicodeDecodeError as e:
-            # If UTF-8 decoding fails, log the error and hex dump for debugging
-            logger.error(f"UTF-8 decode error: {e}")
-            logger.debug(f"Decrypted hex: {decrypted_bytes.hex()}")
-            logger.debug(f"First 100 bytes: {decrypted_bytes[:100].hex()}")
-            raise
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            logger.debug(f"Decrypted text: {decrypted_message}")
-            raise
+            parts.append(_split_message(encrypted_hex_message))
+            indexes.append(index)
+        except Exception as e:
+            logger.error(f"Error decrypting message: {e}")
 
+    if not parts:
+        return results
+
+    try:
+        keystreams = _keystream(
+            key, [(counter, iv, len(ciphertext)) for counter, iv, ciphertext in parts]
+        )
     except Exception as e:
         logger.error(f"Error decrypting message: {e}")
-        return None
+        return results
+
+    for index, (_, _, ciphertext), keystream in zip(indexes, parts, keystreams):
+        # XOR keystream with ciphertext to get plaintext
+        results[index] = strxor(ciphertext, keystream) if ciphertext else b""
+    return results
+
+
+def decrypt_messages(encrypted_hex_messages, key=HEX_KEY):
+    """
+    Decrypts many hex-encoded ChaCha20 encrypted messages and parses them as JSON.
+    Args:
+        encrypted_hex_messages (list[str]): The hex-encoded encrypted messages.
+        key (bytes): The 256-bit key for decryption. Default is a predefined key.
+    Returns:
+        list: The decrypted JSON payloads, None for every message that failed.
+    """
+    results = []
+    for decrypted_bytes in decrypt_payloads(encrypted_hex_messages, key):
+        try:
+            results.append(_parse_plaintext(decrypted_bytes) if decrypted_bytes is not None else None)
+        except Exception as e:
+            logger.error(f"Error decrypting message: {e}")
+            results.append(None)
+    return results
@@ -1,7 +1,10 @@
+import math
 from app.config.firestore import db
 from fastapi import HTTPException
 from datetime import datetime
 
+EARTH_RADIUS_M = 6371000
+
 async def getPackageLocation (trackerId: str):
     """Get the location of a package"""
     trackerDoc = db.collection("trackerCollection").document(trackerId).get()
@@ -23,4 +26,28 @@ async def getPackageLocation (trackerId: str):
         "longitude": tracker_data.get("longitude", 0.0),
     }
         
-    return location
\ No newline at end of file
+    return location
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two coordinates in meters"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """Compass bearing in degrees (0-360) when travelling from the first to the second coordinate"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dlambda = math.radians(lon2 - lon1)
+    x = math.sin(dlambda) * math.cos(phi2)
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlambda)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+
+def heading_difference(heading1, heading2):
+    """Smallest angle in degrees between two headings"""
+    diff = abs(heading1 - heading2) % 360
+    return 360 - diff if diff > 180 else diff
@@ -3,8 +3,16 @@ import ntplib
 import logging
 import os
 from dotenv import load_dotenv
+from collections import deque
+import statistics
+import threading
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -14,31 +22,90 @@ load_dotenv()
 # Default NTP server
 NTP_SERVER = os.getenv("NTP_SERVER", "time.nist.gov")
 
+# Seconds between NTP refreshes, and the shorter retry delay after a failed one
+NTP_REFRESH_INTERVAL = int(os.getenv("NTP_REFRESH_INTERVAL", 900))
+NTP_RETRY_INTERVAL = int(os.getenv("NTP_RETRY_INTERVAL", 60))
+# Number of recent offsets the applied offset is smoothed over
+NTP_SAMPLE_WINDOW = int(os.getenv("NTP_SAMPLE_WINDOW", 5))
+
 _ntp_offset = 0.0
 _last_sync = 0
+_ntp_samples = deque(maxlen=NTP_SAMPLE_WINDOW)
+_ntp_status = {
+    "lastSync": None,
+    "lastError": None,
+    "consecutiveFailures": 0,
+    "lastSampleOffset": None,
+}
+_refresher_thread = None
+_refresher_stop = threading.Event()
 
 
 # NTP use in MQTT
 def sync_ntp_time():
-    """Synchronize with NTP server and calculate offset"""
+    """Take one NTP sample and update the smoothed offset, returns True on success"""
     global _ntp_offset, _last_sync
-    current_time = time.time()
+    try:
+        ntp_client = ntplib.NTPClient()
+        response = ntp_client.request(NTP_SERVER, timeout=5)
+        _ntp_samples.append(response.offset)
+        # The median of recent samples ignores the odd sample skewed by network delay
+        _ntp_offset = statistics.median(_ntp_samples)
+        _last_sync = time.time()
+        _ntp_status.update(
+            lastSync=datetime.fromtimestamp(_last_sync, timezone.utc).isoformat(),
+            lastError=None,
+            consecutiveFailures=0,
+            lastSampleOffset=response.offset,
+        )
+        logger.debug(f"NTP synchronized. Sample: {response.offset:.3f}s, offset: {_ntp_offset:.3f}s")
+        return True
+    except Exception as e:
+        _ntp_status["lastError"] = str(e)
+        _ntp_status["consecutiveFailures"] += 1
+        logger.error(f"Error synchronizing NTP time: {str(e)}")
+        return False
+
+
+def _ntp_refresher():
+    """Keep the NTP offset fresh in the background so readers never touch the network"""
+    while not _refresher_stop.is_set():
+        delay = NTP_REFRESH_INTERVAL if sync_ntp_time() else NTP_RETRY_INTERVAL
+        _refresher_stop.wait(delay)
+
+
+def start_ntp_refresher():
+    """Start the background NTP refresher thread"""
+    global _refresher_thread
+    if _refresher_thread and _refresher_thread.is_alive():
+        return
+    _refresher_stop.clear()
+    _refresher_thread = threading.Thread(target=_ntp_refresher, name="ntp-refresher", daemon=True)
+    _refresher_thread.start()
+
 
-    # Only sync if more than 15 minutes have passed
-    if current_time - _last_sync > 900:  # 15 minutes in seconds
-        try:
-            ntp_client = ntplib.NTPClient()
-            response = ntp_client.request(NTP_SERVER, timeout=5)
-            _ntp_offset = response.offset
-            _last_sync = current_time
-            logger.debug(f"NTP synchronized. Offset: {_ntp_offset:.3f}s")
-        except Exception as e:
-            logger.error(f"Error synchronizing NTP time: {str(e)}")
+def stop_ntp_refresher():
+    """Stop the background NTP refresher thread"""
+    global _refresher_thread
+    _refresher_stop.set()
+    if _refresher_thread:
+        _refresher_thread.join(timeout=10)
+    _refresher_thread = None
+
+
+def get_ntp_status():
+    """Get the NTP offset and whether it was refreshed recently enough to trust"""
+    healthy = _last_sync > 0 and time.time() - _last_sync < 2 * NTP_REFRESH_INTERVAL
+    return {
+        **_ntp_status,
+        "offset": _ntp_offset,
+        "samples": len(_ntp_samples),
+        "healthy": healthy,
+    }
 
 
 def get_accurate_time():
-    """Get current time adjusted with NTP offset"""
-    sync_ntp_time()  # Will only sync if needed
+    """Get current time adjusted with NTP offset, the offset is maintained by the refresher"""
     return datetime.fromtimestamp(time.time() + _ntp_offset, timezone.utc)
 
 
@@ -84,3 +151,57 @@ def get_wib_day_range():
     today_end_utc = wib_today_end - timedelta(hours=7)
 
     return today_start_utc, today_end_utc
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_gps_timestamp(timestamp_str):
+    """Parse the ISO timestamp sent by the tracker, handling the 'Z' suffix"""
+    if timestamp_str.endswith("Z"):
+        # Replace Z with +00:00 (UTC)
+        timestamp_str = timestamp_str[:-1] + "+00:00"
+    return datetime.fromisoformat(timestamp_str)
+
+
+def to_epoch_us(value):
+    """
+    Convert a timestamp to integer epoch microseconds (UTC), the storage format of GPS times.
+    Args:
+        value (datetime | str | int | None): Naive datetimes and ISO strings without offset are taken as UTC.
+    Returns:
+        int | None: Epoch microseconds, None stays None.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // _ONE_MICROSECOND
+
+
+def epoch_us_to_datetime(value):
+    """Convert epoch microseconds back to an aware UTC datetime, None stays None"""
+    if value is None:
+        return None
+    return EPOCH + timedelta(microseconds=value)
+
+
+def epoch_us_to_iso(values):
+    """
+    Format a column of epoch microseconds as ISO 8601 UTC strings in one pass.
+    Args:
+        values (list): Epoch microseconds, None for missing values.
+    Returns:
+        list: Strings like 2025-05-14T04:44:49.351000Z, None for missing values.
+    """
+    if np is not None:
+        times = np.array(values, dtype="datetime64[us]")
+        strings = np.datetime_as_string(times, unit="us", timezone="UTC")
+        return np.where(np.isnat(times), None, strings).tolist()
+    return [
+        None if value is None else (EPOCH + timedelta(microseconds=value)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        for value in values
+    ]
@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from collections import deque
+
+# What a full queue does with a new item
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST_PER_TRACKER = "drop_oldest_per_tracker"
+KEEP_LATEST = "keep_latest"
+TRACKER_QUEUE_POLICIES = (DROP_NEWEST, DROP_OLDEST_PER_TRACKER, KEEP_LATEST)
+
+
+class TrackerQueue:
+    """Bounded FIFO of per-tracker items that can shed load per tracker instead of blindly"""
+
+    def __init__(self, maxsize, policy=DROP_OLDEST_PER_TRACKER):
+        if policy not in TRACKER_QUEUE_POLICIES:
+            raise ValueError(f"Unknown tracker queue policy '{policy}'")
+        self.maxsize = maxsize
+        self.policy = policy
+        # Items per tracker, oldest first, plus one tracker id per item in arrival order
+        self._items = {}
+        self._order = deque()
+        self._size = 0
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def put(self, trackerId, item):
+        """Queue an item, returns the number of items dropped to make room (or 1 if it was dropped itself)"""
+        with self._not_empty:
+            items = self._items.get(trackerId)
+
+            if self.policy == KEEP_LATEST and items:
+                # Only the newest item of a tracker is worth keeping
+                dropped = len(items)
+                self._size -= dropped - 1
+                items.clear()
+                items.append((item, time.monotonic()))
+                return dropped
+
+            dropped = 0
+            if self._size >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    return 1
+                if self.policy == DROP_OLDEST_PER_TRACKER and items:
+                    # The tracker's own oldest item goes, its arrival slot is reused
+                    items.popleft()
+                    items.append((item, time.monotonic()))
+                    return 1
+                if self.policy == KEEP_LATEST:
+                    return 1
+                # A tracker with nothing queued evicts the oldest item of the whole queue
+                self._drop_oldest()
+                dropped = 1
+
+            if items is None:
+                items = self._items[trackerId] = deque()
+            items.append((item, time.monotonic()))
+            self._order.append(trackerId)
+            self._size += 1
+            self._not_empty.notify()
+            return dropped
+
+    def _drop_oldest(self):
+        while self._order:
+            trackerId = self._order.popleft()
+            items = self._items.get(trackerId)
+            if items:
+                items.popleft()
+                self._size -= 1
+                if not items:
+                    del self._items[trackerId]
+                return
+
+    def get(self, timeout=None):
+        """Pop the oldest (item, queued at) pair, raises queue.Empty after timeout seconds"""
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._size > 0, timeout):
+                raise queue.Empty
+            while True:
+                trackerId = self._order.popleft()
+                items = self._items.get(trackerId)
+                # keep_latest leaves arrival slots of replaced items behind, skip them
+                if items:
+                    break
+            entry = items.popleft()
+            if not items:
+                del self._items[trackerId]
+            self._size -= 1
+            return entry
+
+    def qsize(self):
+        with self._not_empty:
+            return self._size
+
+    def empty(self):
+        return self.qsize() == 0
@@ -0,0 +1,89 @@
+"""
+Microbenchmark of GPS message decoding, before and after the single-pass decoder.
+
+Usage (from the repository root):
+    python -m scripts.bench_decode [--messages N] [--repeat N]
+
+Both paths start from decrypted payload bytes and end with a validated fix and its
+parsed device time, so the decrypt step (shared by both) is left out.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from app.models.mqttModel import GPSDataModel
+from app.utils.decode import decode_gps_record
+from app.utils.time import parse_gps_timestamp
+
+
+def make_payloads(count):
+    """Pretty-printed JSON payloads like the tracker firmware sends"""
+    start = datetime(2025, 5, 14, 4, 44, 49, tzinfo=timezone.utc)
+    payloads = []
+    for i in range(count):
+        payloads.append(
+            json.dumps(
+                {
+                    "id": f"CC:DB:A7:9B:7A:{i % 256:02X}",
+                    "lat": -6.2088 + i * 1e-5,
+                    "long": 106.8456 - i * 1e-5,
+                    "satellites": 9,
+                    "iteration": i,
+                    "timestamp": (start + timedelta(seconds=i)).isoformat().replace("+00:00", "Z"),
+                },
+                indent=2,
+            ).encode("utf-8")
+        )
+    return payloads
+
+
+def decode_before(payload):
+    """json.loads, timestamp parse for latency, pydantic model, then a second timestamp parse"""
+    data = json.loads(payload.decode("utf-8"))
+    send_time = parse_gps_timestamp(data["timestamp"])
+    gps_data = GPSDataModel(**data)
+    timestamp = parse_gps_timestamp(gps_data.timestamp)
+    return gps_data, send_time, timestamp
+
+
+def decode_after(payload):
+    """One validate_json call, the record carries its parsed device time"""
+    gps_data = decode_gps_record(payload)
+    return gps_data, gps_data.send_time
+
+
+def bench(decode, payloads, repeat):
+    """Best messages/sec over repeat runs"""
+    best = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        elapsed = time.perf_counter() - started
+        best = max(best, len(payloads) / elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GPS message decoding")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per decoder, the best one is reported")
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.messages)
+
+    # Both decoders must agree before their speed means anything
+    for payload in payloads[:100]:
+        before, _, timestamp = decode_before(payload)
+        after, send_time = decode_after(payload)
+        assert (before.id, before.lat, before.long, timestamp) == (after.id, after.lat, after.long, send_time)
+
+    before = bench(decode_before, payloads, args.repeat)
+    after = bench(decode_after, payloads, args.repeat)
+    print(f"before: {before:,.0f} msg/s")
+    print(f"after:  {after:,.0f} msg/s ({after / before:.2f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
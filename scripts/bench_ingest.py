@@ -0,0 +1,318 @@
+"""
+End-to-end ingest benchmark with a simulated fleet, runs offline.
+
+Usage (from the repository root):
+    python -m scripts.bench_ingest --trackers 1000 --rate 1 --duration 30
+    python -m scripts.bench_ingest --trackers 1000 --duration 10 --max-speed
+    python -m scripts.bench_ingest --source broker --broker localhost --port 1883
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m scripts.bench_ingest --firestore emulator
+
+Messages go through on_message and the real ingest pipeline. By default they are
+handed to on_message in-process; with --source broker they are published to a
+local broker and consumed by the real MQTT client. Firestore is a recording stub
+(optionally with --firestore-latency-ms per commit) or the Firestore emulator.
+SQLite writes go to a temporary directory.
+
+Reports sustained messages/sec, on_message time, end-to-end latency percentiles
+(device time to position store, and to Firestore commit) and per-stage times.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# The benchmark must never touch the real SQLite file or a real broker/project by accident
+os.environ.setdefault("MQTT_ENCRYPT_KEY", os.urandom(32).hex())
+os.environ.setdefault("MQTT_TLS", "false")
+
+
+class RecordingFirestore:
+    """Firestore stand-in that keeps no data, it only counts writes and when they were committed"""
+
+    def __init__(self, commit_latency_ms=0):
+        self.commit_latency_ms = commit_latency_ms
+        self.commits = 0
+        self.writes = 0
+        # Device time to commit, in ms, for every tracker update and history point
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return _StubCollection(self, name)
+
+    def batch(self):
+        return _StubBatch(self)
+
+    def get_all(self, refs):
+        return [_StubSnapshot(ref.path, None) for ref in refs]
+
+    def record_commit(self, writes):
+        if self.commit_latency_ms:
+            time.sleep(self.commit_latency_ms / 1000)
+        now = time.time()
+        with self.lock:
+            self.commits += 1
+            self.writes += len(writes)
+            for data in writes:
+                for timestamp in _device_times(data):
+                    self.latencies.append((now - timestamp) * 1000)
+
+
+def _device_times(data):
+    """Device times (epoch seconds) carried by a tracker update, history document or bucket write"""
+    if "lastUpdate" in data:
+        yield data["lastUpdate"].timestamp()
+    if "timestamp" in data:
+        yield data["timestamp"].timestamp()
+    for point in getattr(data.get("points"), "values", []):
+        yield point["t"] / 1000
+
+
+class _StubSnapshot:
+    def __init__(self, path, data):
+        self.id = path.rsplit("/", 1)[-1]
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class _StubDocument:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return _StubCollection(self.store, f"{self.path}/{name}")
+
+    def get(self):
+        return _StubSnapshot(self.path, None)
+
+    def create(self, data):
+        self.store.record_commit([data])
+
+
+class _StubCollection:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+
+    def document(self, documentId):
+        return _StubDocument(self.store, f"{self.path}/{documentId}")
+
+    def select(self, fields):
+        return self
+
+    def where(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def stream(self):
+        return iter([])
+
+    def get(self):
+        return []
+
+
+class _StubBatch:
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(data)
+
+    def update(self, ref, data):
+        self.writes.append(data)
+
+    def delete(self, ref):
+        self.writes.append({})
+
+    def commit(self):
+        self.store.record_commit(self.writes)
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """p50/p95/p99 style summary of a list of numbers"""
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    parts = []
+    for point in points:
+        index = min(len(values) - 1, int(len(values) * point / 100))
+        parts.append(f"p{point} {values[index]:,.1f}")
+    return ", ".join(parts) + f", max {values[-1]:,.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest pipeline with a simulated fleet")
+    parser.add_argument("--trackers", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=1.0, help="Fixes per second per tracker")
+    parser.add_argument("--duration", type=float, default=20, help="Simulated seconds")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Share of messages sent twice")
+    parser.add_argument("--bursts", type=float, default=0.0, help="Chance per fix of a reconnect burst")
+    parser.add_argument("--format", choices=["hex", "binary"], default="hex")
+    parser.add_argument("--max-speed", action="store_true", help="Publish as fast as possible instead of in real time")
+    parser.add_argument("--source", choices=["inprocess", "broker"], default="inprocess")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--firestore", choices=["stub", "emulator"], default="stub")
+    parser.add_argument("--firestore-latency-ms", type=float, default=0, help="Added to every stub commit")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # App modules read their configuration at import, so everything is set up before importing them
+    workdir = tempfile.mkdtemp(prefix="lokatrack-bench-")
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workdir)
+    if args.source == "broker":
+        os.environ["MQTT_BROKER"] = args.broker
+        os.environ["MQTT_PORT"] = str(args.port)
+        os.environ.setdefault("MQTT_TOPIC", "lokatrack/bench")
+
+    from app.config.logging import configure_logging
+    import app.config.firestore as firestoreConfig
+    import app.services.mqttService as mqttService
+    import app.services.positionService as positionService
+    import app.services.ingestService as ingestService
+    import app.config.mqtt as mqttConfig
+    from scripts.simulate_fleet import make_fleet, generate_messages
+    from app.utils.decrypt import HEX_KEY, DECRYPT_BACKEND
+
+    configure_logging(os.getenv("LOG_LEVEL", "WARNING"))
+
+    if args.firestore == "emulator":
+        if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+            parser.error("--firestore emulator needs FIRESTORE_EMULATOR_HOST")
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore
+
+        db = firestore.Client(project=os.getenv("PROJECT_ID", "lokatrack-bench"), credentials=AnonymousCredentials())
+    else:
+        db = RecordingFirestore(args.firestore_latency_ms)
+    for module in (firestoreConfig, mqttService, positionService):
+        module.db = db
+
+    # Device time to the moment a fix lands in the in-memory position store
+    position_latencies = []
+    update_position = ingestService.update_position
+
+    def timed_update_position(trackerId, latitude, longitude, lastUpdate):
+        position_latencies.append((time.time() - lastUpdate.timestamp()) * 1000)
+        return update_position(trackerId, latitude, longitude, lastUpdate)
+
+    ingestService.update_position = timed_update_position
+
+    # Time spent inside the MQTT callback, the only work done on the paho thread
+    on_message_times = []
+    on_message = mqttConfig.on_message
+
+    def timed_on_message(client, userdata, msg):
+        started = time.perf_counter()
+        on_message(client, userdata, msg)
+        on_message_times.append((time.perf_counter() - started) * 1e6)
+
+    mqttConfig.on_message = timed_on_message
+
+    ingestService.start_ingest_pipeline()
+    publisher = None
+    if args.source == "broker":
+        import paho.mqtt.client as mqtt
+
+        mqttConfig.start_mqtt_client()
+        publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"lokatrack-bench-{os.getpid()}")
+        publisher.connect(args.broker, args.port)
+        publisher.loop_start()
+        # Give the consumer time to subscribe
+        time.sleep(1)
+
+    class Message:
+        __slots__ = ("payload", "topic")
+
+        def __init__(self, payload):
+            self.payload = payload
+            self.topic = mqttConfig.MQTT_TOPICS[0]
+
+    fleet = make_fleet(args.trackers, args.seed)
+    if args.max_speed:
+        # Pre-encrypt so only the server side is measured
+        messages = [
+            payload
+            for _, payload in generate_messages(
+                fleet, HEX_KEY, args.rate, args.duration, args.duplicates, args.bursts, args.format, seed=args.seed
+            )
+        ]
+        schedule = ((None, payload) for payload in messages)
+    else:
+        schedule = generate_messages(
+            fleet, HEX_KEY, args.rate, args.duration, args.duplicates, args.bursts, args.format, seed=args.seed
+        )
+
+    published = 0
+    started = time.time()
+    for due, payload in schedule:
+        if due is not None:
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        if publisher:
+            publisher.publish(mqttConfig.MQTT_TOPICS[0], payload)
+        else:
+            mqttConfig.on_message(None, None, Message(payload))
+        published += 1
+    publish_elapsed = time.time() - started
+
+    # Wait until the decode side caught up, then drain the Firestore queue and the SQLite writer
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        stats = ingestService.get_ingest_stats()
+        handled = stats["received"] + stats["dropped"]
+        done = stats["processed"] + stats["failed"] + stats["duplicates"]
+        if handled >= published and stats["queueDepth"] == 0 and done >= stats["received"]:
+            break
+        time.sleep(0.05)
+    ingest_elapsed = time.time() - started
+    if publisher:
+        publisher.loop_stop()
+        publisher.disconnect()
+        mqttConfig.stop_mqtt_client()
+    ingestService.stop_ingest_pipeline(timeout=60)
+    total_elapsed = time.time() - started
+    stats = ingestService.get_ingest_stats()
+
+    print(f"decrypt backend: {DECRYPT_BACKEND}, format: {args.format}, source: {args.source}, firestore: {args.firestore}")
+    print(f"published {published:,} messages in {publish_elapsed:.2f}s ({published / publish_elapsed:,.0f} msg/s)")
+    print(f"ingested in {ingest_elapsed:.2f}s: {stats['received'] / ingest_elapsed:,.0f} msg/s sustained")
+    print(
+        f"received {stats['received']:,}, processed {stats['processed']:,}, failed {stats['failed']:,}, "
+        f"dropped {stats['dropped']:,}, duplicates {stats['duplicates']:,}, late {stats['late']:,}, "
+        f"firestore shed {stats['firestoreDropped']:,}, firestore failed {stats['firestoreFailed']:,}"
+    )
+    print(f"on_message (us): {percentiles(on_message_times)}")
+    if args.max_speed:
+        print("end-to-end latency is not meaningful with --max-speed, device times run ahead of the clock")
+    else:
+        print(f"device -> position store (ms): {percentiles(position_latencies)}")
+        if isinstance(db, RecordingFirestore):
+            print(f"device -> firestore commit (ms): {percentiles(db.latencies)}")
+    print(f"ingest lag (ms): last {stats['ingestLagMs']:,.1f}, max {stats['maxIngestLagMs']:,.1f}")
+    print("stages:")
+    for name, stage in stats["stages"].items():
+        print(
+            f"  {name:<16} {stage['calls']:>7,} calls  {stage['totalMs']:>10,.1f} ms total  "
+            f"{stage['avgMsPerMessage'] * 1000:>8,.1f} us/msg  max {stage['maxMs']:,.1f} ms"
+        )
+    if isinstance(db, RecordingFirestore):
+        print(f"firestore: {db.commits:,} commits, {db.writes:,} writes ({db.writes / total_elapsed:,.0f} writes/s)")
+    print(f"sqlite: {os.path.join(workdir, 'data', 'mqtt_data.db')}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
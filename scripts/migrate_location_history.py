@@ -0,0 +1,132 @@
+"""
+Rewrite locationHistory subcollections into hourly locationBuckets documents.
+
+Usage (from the repository root):
+    python -m scripts.migrate_location_history [--tracker ID] [--delete] [--dry-run]
+
+Run it before switching HISTORY_STORAGE_MODE to "buckets". It is safe to run again:
+points are appended with ArrayUnion, so re-migrated points are not duplicated.
+"""
+import argparse
+import logging
+from datetime import datetime, timezone
+from google.cloud import firestore
+from app.config.firestore import db
+from app.config.logging import configure_logging
+from app.services.mqttService import (
+    FIRESTORE_MAX_BATCH_WRITES,
+    history_bucket_id,
+    history_bucket_point,
+)
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects requests over 10 MiB, bucket writes are committed well below that
+MIGRATION_BATCH_BYTES = 4 * 1024 * 1024
+# Generous estimate of one point ({"lat", "lon", "t"}) in a write request
+POINT_BYTES = 96
+
+
+def _delete_documents(refs):
+    """Delete documents in batches of at most FIRESTORE_MAX_BATCH_WRITES"""
+    for offset in range(0, len(refs), FIRESTORE_MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref in refs[offset:offset + FIRESTORE_MAX_BATCH_WRITES]:
+            batch.delete(ref)
+        batch.commit()
+
+
+def migrate_tracker(trackerRef, delete=False, dry_run=False):
+    """
+    Migrate the history of one tracker, returns (points, buckets).
+    History is streamed in time order and written one bucket at a time, so only the buckets of
+    the next commit are kept in memory. A commit holds at most MIGRATION_BATCH_BYTES of points.
+    """
+    totalPoints = 0
+    totalBuckets = 0
+    # Finished buckets waiting for the next commit: (bucket id, points, history documents)
+    pending = []
+    pendingBytes = 0
+
+    def commit_pending():
+        nonlocal pending, pendingBytes
+        if pending and not dry_run:
+            batch = db.batch()
+            for bucketId, points, _ in pending:
+                bucketStart = datetime.strptime(bucketId, "%Y%m%d%H").replace(tzinfo=timezone.utc)
+                batch.set(
+                    trackerRef.collection("locationBuckets").document(bucketId),
+                    {"start": bucketStart, "points": firestore.ArrayUnion(points)},
+                    merge=True,
+                )
+            batch.commit()
+            # Only delete the old documents once their buckets are committed
+            if delete:
+                _delete_documents([ref for _, _, historyRefs in pending for ref in historyRefs])
+        pending = []
+        pendingBytes = 0
+
+    def finish_bucket(bucketId, points, historyRefs):
+        nonlocal pendingBytes, totalPoints, totalBuckets
+        size = len(points) * POINT_BYTES
+        if pending and (
+            pendingBytes + size > MIGRATION_BATCH_BYTES or len(pending) == FIRESTORE_MAX_BATCH_WRITES
+        ):
+            commit_pending()
+        pending.append((bucketId, points, historyRefs))
+        pendingBytes += size
+        totalPoints += len(points)
+        totalBuckets += 1
+
+    # Time order fills one bucket after the other, points stay sorted inside the array
+    bucketId = None
+    points = []
+    historyRefs = []
+    for doc in trackerRef.collection("locationHistory").order_by("timestamp").stream():
+        historyData = doc.to_dict()
+        location = historyData.get("location")
+        timestamp = historyData.get("timestamp")
+        if not location or not timestamp:
+            logger.warning(f"Skipping incomplete history document {doc.id} of {trackerRef.id}")
+            continue
+        docBucketId = history_bucket_id(timestamp)
+        if docBucketId != bucketId:
+            if points:
+                finish_bucket(bucketId, points, historyRefs)
+            bucketId, points, historyRefs = docBucketId, [], []
+        points.append(history_bucket_point(location.latitude, location.longitude, timestamp))
+        if delete:
+            historyRefs.append(doc.reference)
+    if points:
+        finish_bucket(bucketId, points, historyRefs)
+    commit_pending()
+
+    return totalPoints, totalBuckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate locationHistory documents into hourly buckets")
+    parser.add_argument("--tracker", help="Only migrate this tracker id")
+    parser.add_argument("--delete", action="store_true", help="Delete locationHistory documents after migrating")
+    parser.add_argument("--dry-run", action="store_true", help="Only count points and buckets")
+    args = parser.parse_args()
+
+    configure_logging()
+    if not db:
+        logger.error("Firestore database not initialized")
+        return 1
+
+    trackers = db.collection("trackerCollection")
+    if args.tracker:
+        trackerRefs = [trackers.document(args.tracker)]
+    else:
+        trackerRefs = [doc.reference for doc in trackers.select([]).stream()]
+
+    for trackerRef in trackerRefs:
+        points, buckets = migrate_tracker(trackerRef, delete=args.delete, dry_run=args.dry_run)
+        logger.info(f"{trackerRef.id}: {points} points into {buckets} buckets")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,195 @@
+"""
+Simulate a fleet of GPS trackers publishing encrypted payloads to an MQTT broker.
+
+Usage (from the repository root, MQTT_ENCRYPT_KEY must match the server's):
+    python -m scripts.simulate_fleet --broker localhost --trackers 500 --rate 1 --duration 60
+
+Each tracker drives a smooth route around Jakarta with stops and GPS jitter, and
+publishes hex JSON (what decrypt_message expects) or binary v1 payloads. Retransmits
+(--duplicates) and reconnect bursts of buffered fixes (--bursts) can be mixed in.
+The generator functions are also used in-process by scripts.bench_ingest.
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timezone
+import paho.mqtt.client as mqtt
+from Crypto.Cipher import ChaCha20
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# decrypt reads MQTT_ENCRYPT_KEY when it is imported
+from app.utils.decode import encode_binary_gps_record
+from app.utils.decrypt import BINARY_PAYLOAD_V1, HEX_KEY
+
+# Centre of the simulated service area (Jakarta)
+CENTER_LAT = -6.2088
+CENTER_LON = 106.8456
+METERS_PER_DEGREE = 111_320
+
+
+def make_fleet(count, seed=None):
+    """Create count trackers scattered around the centre"""
+    rng = random.Random(seed)
+    fleet = []
+    for i in range(count):
+        fleet.append(
+            {
+                "id": ":".join(f"{byte:02X}" for byte in (0xCC, 0xDB, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF, 0x10)),
+                "lat": CENTER_LAT + rng.uniform(-0.1, 0.1),
+                "lon": CENTER_LON + rng.uniform(-0.1, 0.1),
+                "heading": rng.uniform(0, 360),
+                "speed": rng.uniform(5, 17),  # m/s
+                "parked": 0,
+                "iteration": 0,
+                # Each device has its own nonce and a running 64-byte block counter
+                "nonce": rng.randbytes(8),
+                "counter": 0,
+                "rng": random.Random(rng.random()),
+            }
+        )
+    return fleet
+
+
+def next_fix(tracker, now, interval):
+    """Move a tracker along its route by interval seconds and return its new fix"""
+    rng = tracker["rng"]
+    if tracker["parked"]:
+        tracker["parked"] -= 1
+    elif rng.random() < 0.01:
+        # Stop at a customer for a while
+        tracker["parked"] = rng.randint(30, 300)
+    else:
+        tracker["heading"] = (tracker["heading"] + rng.gauss(0, 15)) % 360
+        tracker["speed"] = min(25, max(2, tracker["speed"] + rng.gauss(0, 1.5)))
+        distance = tracker["speed"] * interval
+        heading = math.radians(tracker["heading"])
+        tracker["lat"] += distance * math.cos(heading) / METERS_PER_DEGREE
+        tracker["lon"] += distance * math.sin(heading) / (METERS_PER_DEGREE * math.cos(math.radians(tracker["lat"])))
+
+    tracker["iteration"] += 1
+    jitter = 3 / METERS_PER_DEGREE
+    return {
+        "id": tracker["id"],
+        "lat": round(tracker["lat"] + rng.gauss(0, jitter), 7),
+        "long": round(tracker["lon"] + rng.gauss(0, jitter), 7),
+        "satellites": rng.randint(4, 12),
+        "iteration": tracker["iteration"],
+        "timestamp": now,
+    }
+
+
+def encode_payload(tracker, fix, key, payload_format="hex"):
+    """Encrypt a fix the way the tracker firmware does"""
+    if payload_format == "binary":
+        plaintext = encode_binary_gps_record(
+            fix["id"], fix["lat"], fix["long"], int(fix["timestamp"] * 1000), fix["satellites"], fix["iteration"]
+        )
+    else:
+        timestamp = datetime.fromtimestamp(fix["timestamp"], timezone.utc)
+        data = dict(fix, timestamp=timestamp.isoformat(timespec="milliseconds").replace("+00:00", "Z"))
+        plaintext = json.dumps(data, indent=2).encode("utf-8")
+
+    counter = tracker["counter"]
+    tracker["counter"] += (len(plaintext) + 63) // 64
+    cipher = ChaCha20.new(key=key, nonce=tracker["nonce"])
+    cipher.seek(counter * 64)
+    message = tracker["nonce"] + counter.to_bytes(8, "little") + cipher.encrypt(plaintext)
+    if payload_format == "binary":
+        return BINARY_PAYLOAD_V1 + message
+    return message.hex().encode("ascii")
+
+
+def generate_messages(fleet, key, rate, duration, duplicates=0.0, bursts=0.0, payload_format="hex", start=None, seed=None):
+    """
+    Yield (due time, payload) for the whole fleet, in due time order.
+    Args:
+        rate (float): Fixes per second per tracker.
+        duplicates (float): Share of messages published twice, like QoS retransmits.
+        bursts (float): Chance per fix that a tracker loses its connection for 10-60 fixes,
+            then publishes everything it buffered at once on reconnect.
+    """
+    rng = random.Random(seed)
+    interval = 1 / rate
+    start = time.time() if start is None else start
+    end = start + duration
+    # Spread the trackers over the first interval so they don't all publish at once
+    schedule = [(start + rng.uniform(0, interval), index) for index in range(len(fleet))]
+    heapq.heapify(schedule)
+    offline = {}
+
+    while schedule:
+        due, index = heapq.heappop(schedule)
+        if due >= end:
+            continue
+        tracker = fleet[index]
+        payload = encode_payload(tracker, next_fix(tracker, due, interval), key, payload_format)
+        heapq.heappush(schedule, (due + interval, index))
+
+        if index in offline:
+            buffered, remaining = offline[index]
+            buffered.append(payload)
+            if remaining > 1:
+                offline[index] = (buffered, remaining - 1)
+                continue
+            # Reconnected: the newest fix first, then the backlog, which the server sees as late
+            del offline[index]
+            yield due, buffered[-1]
+            for late in buffered[:-1]:
+                yield due, late
+            continue
+        if rng.random() < bursts:
+            offline[index] = ([payload], rng.randint(10, 60))
+            continue
+
+        yield due, payload
+        if rng.random() < duplicates:
+            yield due, payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish simulated tracker payloads to an MQTT broker")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--topic", default=os.getenv("MQTT_TOPIC", "lokatrack/gps"))
+    parser.add_argument("--trackers", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="Fixes per second per tracker")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to publish for")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Share of messages sent twice")
+    parser.add_argument("--bursts", type=float, default=0.0, help="Chance per fix of a reconnect burst")
+    parser.add_argument("--format", choices=["hex", "binary"], default="hex")
+    parser.add_argument("--qos", type=int, default=0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    key = HEX_KEY
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"lokatrack-sim-{os.getpid()}")
+    client.connect(args.broker, args.port)
+    client.loop_start()
+
+    fleet = make_fleet(args.trackers, args.seed)
+    sent = 0
+    started = time.time()
+    for due, payload in generate_messages(
+        fleet, key, args.rate, args.duration, args.duplicates, args.bursts, args.format, seed=args.seed
+    ):
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        client.publish(args.topic, payload, qos=args.qos)
+        sent += 1
+
+    client.loop_stop()
+    client.disconnect()
+    elapsed = time.time() - started
+    print(f"published {sent} messages in {elapsed:.1f}s ({sent / elapsed:,.0f} msg/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())